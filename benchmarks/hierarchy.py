@@ -0,0 +1,200 @@
+import gevent
+import gevent.lock
+import logging
+import multiprocessing
+import random
+import struct
+import zlib
+from benchmarks.parser import encode_response
+from dns_parser import ParseError, parse_dns_response
+from gevent.server import DatagramServer, StreamServer
+from transport import TCP_LENGTH, receive_exactly
+from utils import QType, RCode, Site, question_end
+
+
+# A fake DNS tree served from loopback: one root, a few TLDs and a number of
+# zones spread over a pool of authoritative servers. Every server gets its own
+# 127.53.x.y address (the resolver uses one port for every nameserver). Zones
+# delegated without glue point at nameservers in the "hosting.tld0" zone. Names
+# on a CDN are CNAMEs to a per-zone name in "cdn.tld0", which is in turn a CNAME
+# to one of a few edge names shared by all zones, like CDN-hosted names are.
+NETWORK = "127.53"
+ROOT_IP = f"{NETWORK}.0.1"
+HOSTING_ZONE = "hosting.tld0"
+CDN_ZONE = "cdn.tld0"
+CDN_EDGES = 16
+FLAG_TC = 0x0200
+REFERRAL = 0x8000
+AUTHORITATIVE = 0x8400
+REFUSED = 5
+
+
+def fraction_of(name, salt, fraction):
+    # a stable choice per name, so a replayed query mix sees the same tree every run
+    return zlib.crc32(f"{salt}:{name}".encode("utf-8")) % 10000 < fraction * 10000
+
+def address_of(name):
+    value = zlib.crc32(name.encode("utf-8"))
+    return f"10.{value >> 16 & 0xFF}.{value >> 8 & 0xFF}.{value & 0xFF}"
+
+
+class Hierarchy:
+    def __init__(
+        self, tlds=4, zones=400, servers=8, port=5300, latency=0.002, loss=0.0, glueless=0.1, truncation=0.0, cnames=0.0,
+        ttl=300,
+    ):
+        self.port = port
+        self.latency = latency
+        self.loss = loss
+        self.truncation = truncation
+        self.cnames = cnames
+        self.ttl = ttl
+        self.tlds = {f"tld{i}": f"{NETWORK}.1.{i + 1}" for i in range(tlds)}
+        self.servers = [f"{NETWORK}.2.{i + 1}" for i in range(servers)]
+        self.zones = {f"zone{i}.tld{i % tlds}": self.servers[i % servers] for i in range(zones)}
+        self.zones[HOSTING_ZONE] = self.servers[0]
+        self.zones[CDN_ZONE] = self.servers[-1]
+        self.glueless = {zone for zone in self.zones if zone != HOSTING_ZONE and fraction_of(zone, "glueless", glueless)}
+        self.process = None
+
+    @property
+    def roots(self):
+        return (Site("a.root-servers.test", ROOT_IP),)
+
+    def addresses(self):
+        return [ROOT_IP, *self.tlds.values(), *self.servers]
+
+    def nameserver(self, zone):
+        if zone in self.glueless:
+            index = self.servers.index(self.zones[zone])
+            return f"ns{index}.{HOSTING_ZONE}", self.servers[index]
+        return f"ns1.{zone}", self.zones[zone]
+
+    def alias_of(self, qname, zone):
+        label = qname.split(".")[0]
+        if zone == CDN_ZONE:
+            if label.startswith("edge"):
+                return None
+            return f"edge{zlib.crc32(qname.encode('utf-8')) % CDN_EDGES}.{CDN_ZONE}"
+        if zone == HOSTING_ZONE or label == "ns1" or not fraction_of(qname, "cname", self.cnames):
+            return None
+        return f"{zone.replace('.', '-')}.{CDN_ZONE}"
+
+    def soa(self, zone):
+        return (zone, QType.SOA, self.ttl, (f"ns1.{zone}", f"hostmaster.{zone}", 1, 3600, 600, 86400, 60))
+
+    def answer(self, server, qname, qtype):
+        labels = qname.lower().split(".")
+        if server == ROOT_IP:
+            tld = labels[-1]
+            if tld not in self.tlds:
+                return encode_response(qname, qtype, authority=[self.soa("")], flags=AUTHORITATIVE | RCode.NXDOMAIN)
+            ns_name = f"a.nic.{tld}"
+            return encode_response(
+                qname, qtype, authority=[(tld, QType.NS, self.ttl, ns_name)],
+                additional=[(ns_name, QType.A, self.ttl, self.tlds[tld])], flags=REFERRAL,
+            )
+
+        zone = ".".join(labels[-2:])
+        if server in self.tlds.values():
+            if zone not in self.zones:
+                return encode_response(qname, qtype, authority=[self.soa(labels[-1])], flags=AUTHORITATIVE | RCode.NXDOMAIN)
+            ns_name, ip = self.nameserver(zone)
+            additional = [] if zone in self.glueless else [(ns_name, QType.A, self.ttl, ip)]
+            return encode_response(
+                qname, qtype, authority=[(zone, QType.NS, self.ttl, ns_name)], additional=additional, flags=REFERRAL
+            )
+
+        if self.zones.get(zone) != server:
+            return encode_response(qname, qtype, flags=REFERRAL | REFUSED)
+        alias = self.alias_of(qname.lower(), zone)
+        if alias is not None:
+            answer = [(qname, QType.CNAME, self.ttl, alias)]
+            if zone == CDN_ZONE and qtype is QType.A:  # the edge is in the same zone, the answer carries the whole chain
+                answer.append((alias, QType.A, self.ttl, address_of(alias)))
+            return encode_response(qname, qtype, answer=answer, flags=AUTHORITATIVE)
+        if qtype is not QType.A:
+            return encode_response(qname, qtype, authority=[self.soa(zone)], flags=AUTHORITATIVE)
+        if zone == HOSTING_ZONE and labels[0].startswith("ns") and labels[0][2:].isdigit():
+            ip = self.servers[int(labels[0][2:]) % len(self.servers)]
+        elif qname.lower() == f"ns1.{zone}":
+            ip = server
+        else:
+            ip = address_of(qname.lower())
+        return encode_response(qname, qtype, answer=[(qname, QType.A, self.ttl, ip)], flags=AUTHORITATIVE)
+
+    def respond(self, server, data, udp):
+        try:
+            query = parse_dns_response(data)
+            qname, qtype, _ = query.question[0]
+            qtype = QType(qtype)
+        except (ParseError, IndexError, ValueError):
+            return None
+        if self.latency:
+            gevent.sleep(self.latency)
+        if udp and self.loss and random.random() < self.loss:
+            return None
+        response = data[:2] + self.answer(server, qname, qtype)[2:]
+        if udp and self.truncation and fraction_of(qname.lower(), "truncation", self.truncation):
+            flags = struct.unpack_from("!H", response, 2)[0] | FLAG_TC
+            response = response[:2] + struct.pack("!HHHHH", flags, 1, 0, 0, 0) + data[12 : question_end(data)]
+        return response
+
+    def serve(self, ready):
+        logging.getLogger().setLevel(logging.WARNING)
+        servers = []
+        for server in self.addresses():
+            handler = self.udp_handler(server)
+            udp = handler.server = DatagramServer((server, self.port), handler)
+            tcp = StreamServer((server, self.port), self.tcp_handler(server))
+            udp.start()
+            tcp.start()
+            servers += [udp, tcp]
+        ready.set()
+        gevent.wait()
+
+    def udp_handler(self, server):
+        def handle(data, client):
+            response = self.respond(server, data, udp=True)
+            if response is not None:
+                handle.server.sendto(response, client)
+        return handle
+
+    def tcp_handler(self, server):
+        # pipelined queries are answered concurrently, like a real server would
+        def reply(conn, lock, data):
+            response = self.respond(server, data, udp=False)
+            if response is not None:
+                with lock:
+                    conn.sendall(TCP_LENGTH.pack(len(response)) + response)
+
+        def handle(conn, client):
+            lock = gevent.lock.Semaphore()
+            replies = []
+            try:
+                while True:
+                    prefix = receive_exactly(conn, TCP_LENGTH.size)
+                    if prefix is None:
+                        break
+                    data = receive_exactly(conn, TCP_LENGTH.unpack(prefix)[0])
+                    if data is None:
+                        break
+                    replies.append(gevent.spawn(reply, conn, lock, data))
+            except OSError:
+                pass
+            finally:
+                gevent.joinall(replies)
+                conn.close()
+        return handle
+
+    def start(self):
+        ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=self.serve, args=(ready,), daemon=True)
+        self.process.start()
+        if not ready.wait(10):
+            raise RuntimeError("Fake DNS hierarchy did not start")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
@@ -0,0 +1,249 @@
+import binascii
+import logging
+import socket
+import struct
+import sys
+import timeit
+from dns_parser import parse_dns_response
+from utils import QType, Section
+
+
+# Referrals for the "ru" zone as they were captured from the root servers
+# (NS order rotates between replies), plus an authoritative answer and an
+# NXDOMAIN reply shaped after the examples in README.md.
+RU_NS_ORDERS = (
+    ("a", "b", "d", "e", "f"),
+    ("f", "d", "e", "a", "b"),
+    ("e", "d", "b", "f", "a"),
+)
+RU_GLUE = {
+    "a": ("193.232.128.6", "2001:678:17:0:193:232:128:6"),
+    "b": ("194.85.252.62", "2001:678:16:0:194:85:252:62"),
+    "d": ("194.190.124.17", "2001:678:18:0:194:190:124:17"),
+    "e": ("193.232.142.17", "2001:678:15:0:193:232:142:17"),
+    "f": ("193.232.156.17", "2001:678:14:0:193:232:156:17"),
+}
+FIXTURE_REPEAT = 2000
+
+
+
+def legacy_parse_rr_name(resp, begin):
+    i = end = begin
+    link = False
+    was_new_section = False
+    name = ""
+    while True:
+        byte = resp[i : i + 2]
+        i += 2
+        if byte == "00":
+            break
+        if int(byte, 16) >= int("c0", 16):  # offset
+            offset = int(resp[i - 2 : i + 2], 16) - int("c000", 16)
+            i = 2 * offset
+            if not link and was_new_section:
+                end += 2
+            link = True
+            continue
+        else:
+            was_new_section = True
+
+        url_section_len = int(byte, 16)
+        for _ in range(url_section_len):
+            byte = resp[i : i + 2]
+            symb = bytes.fromhex(byte).decode("utf-8")
+            name += symb
+            if not link:
+                end = i
+            i += 2
+
+        name += "."
+
+    if len(name) > 0 and name[-1] == ".":
+        name = name[:-1]
+    return name, end
+
+def legacy_parse_rr(resp, begin, section):
+    data = {}
+    name, end = legacy_parse_rr_name(resp, begin)
+    begin = end
+    data["NAME"] = name
+    data["TYPE"] = int(resp[begin + 4 : begin + 8], 16)
+    data["CLASS"] = int(resp[begin + 8 : begin + 12], 16)
+    data["TTL"] = int(resp[begin + 12 : begin + 20], 16)
+    data["RDLENGTH"] = int(resp[begin + 20 : begin + 24], 16)
+    rr_end = begin + 24 + data["RDLENGTH"] * 2
+
+    hex_rddata = resp[begin + 24 : rr_end]
+    if section is Section.ANSWER:
+        if data["TYPE"] == 1:
+            if data["RDLENGTH"] == 4:
+                data["RDDATA"] = socket.inet_ntop(
+                    socket.AF_INET, bytearray.fromhex(hex_rddata)
+                )
+            elif data["RDLENGTH"] == 16:
+                data["RDDATA"] = socket.inet_ntop(
+                    socket.AF_INET6, bytearray.fromhex(hex_rddata)
+                )
+        elif data["TYPE"] == 2 or data["TYPE"] == 16:
+            data["RDDATA"], _ = legacy_parse_rr_name(resp, begin + 24)
+        elif data["TYPE"] == 28:
+            data["RDDATA"] = socket.inet_ntop(
+                socket.AF_INET6, bytearray.fromhex(hex_rddata)
+            )
+    elif section is Section.AUTHORITY:
+        data["RDDATA"], _ = legacy_parse_rr_name(resp, begin + 24)
+    elif section is Section.ADDITIONAL:
+        if data["RDLENGTH"] == 4:
+            data["RDDATA"] = socket.inet_ntop(
+                socket.AF_INET, bytearray.fromhex(hex_rddata)
+            )
+        elif data["RDLENGTH"] == 16:
+            data["RDDATA"] = socket.inet_ntop(
+                socket.AF_INET6, bytearray.fromhex(hex_rddata)
+            )
+        else:
+            data["RDDATA"] = hex_rddata
+    else:
+        logging.error("Invalid section for RDDATA while RR parsing")
+        raise Exception("Invalid section for RDDATA while RR parsing")
+
+    return data, rr_end
+
+def legacy_parse_dns_response(resp):
+    resp = resp.replace(" ", "").replace("\n", "")
+    data = {}
+
+    flags = bin(int(resp[4:8], 16))[2:].zfill(16)
+    data["HEADER"] = {
+        "ID": int(resp[:4], 16),
+        "QR": int(flags[0], 2),
+        "Opcode": "%0*X" % (1, int(flags[1:5], 2)),
+        "AA": int(flags[5], 2),
+        "TC": int(flags[6], 2),
+        "RD": int(flags[7], 2),
+        "RA": int(flags[8], 2),
+        "Z": flags[9:12],  # ignoring, must be zeros
+        "RCODE": "%0*X" % (1, int(flags[12:16], 2)),
+        "QDCOUNT": int(resp[8:12], 16),
+        "ANCOUNT": int(resp[12:16], 16),
+        "NSCOUNT": int(resp[16:20], 16),
+        "ARCOUNT": int(resp[20:24], 16),
+    }
+
+    # QUESTION (skip)
+    qname_end = resp.find("00", 24, len(resp))
+    if qname_end == -1:
+        logging.error("Invalid header response.")
+        raise Exception("Invalid header response.")
+    q_end = 2 + qname_end + 8  # after qtype and qclass both
+
+    # ANSWER
+    data["ANSWER"] = []
+    rr_end = q_end
+    for _ in range(data["HEADER"]["ANCOUNT"]):
+        rr, rr_end = legacy_parse_rr(resp, rr_end, Section.ANSWER)
+        data["ANSWER"].append(rr)
+
+    # AUTHORITY
+    data["AUTHORITY"] = []
+    for _ in range(data["HEADER"]["NSCOUNT"]):
+        rr, rr_end = legacy_parse_rr(resp, rr_end, Section.AUTHORITY)
+        data["AUTHORITY"].append(rr)
+
+    # ADDITIONAL
+    data["ADDITIONAL"] = []
+    for _ in range(data["HEADER"]["ARCOUNT"]):
+        rr, rr_end = legacy_parse_rr(resp, rr_end, Section.ADDITIONAL)
+        data["ADDITIONAL"].append(rr)
+
+    return data
+
+
+def encode_name(name, offsets, message_len):
+    out = b""
+    labels = name.split(".") if name else []
+    for i in range(len(labels)):
+        suffix = ".".join(labels[i:]).lower()
+        if suffix in offsets:
+            return out + struct.pack("!H", 0xC000 | offsets[suffix])
+        if message_len + len(out) < 0x4000:
+            offsets[suffix] = message_len + len(out)
+        label = labels[i].encode("utf-8")
+        out += bytes((len(label),)) + label
+    return out + b"\x00"
+
+def encode_response(qname, qtype, answer=(), authority=(), additional=(), flags=0x8000):
+    offsets = {}
+    message = struct.pack("!HHHHHH", 0xAAAA, flags, 1, len(answer), len(authority), len(additional))
+    message += encode_name(qname, offsets, len(message)) + struct.pack("!HH", qtype.value, 1)
+    for name, rtype, ttl, rdata in (*answer, *authority, *additional):
+        message += encode_name(name, offsets, len(message))
+        if rtype is QType.A:
+            rdata = socket.inet_pton(socket.AF_INET, rdata)
+        elif rtype is QType.AAAA:
+            rdata = socket.inet_pton(socket.AF_INET6, rdata)
+        elif rtype in (QType.NS, QType.CNAME):
+            rdata = encode_name(rdata, offsets, len(message) + 10)
+        elif rtype is QType.SOA:
+            rdata_start = len(message) + 10
+            mname = encode_name(rdata[0], offsets, rdata_start)
+            rname = encode_name(rdata[1], offsets, rdata_start + len(mname))
+            rdata = mname + rname + struct.pack("!IIIII", *rdata[2:])
+        message += struct.pack("!HHIH", rtype.value, 1, ttl, len(rdata)) + rdata
+    return message
+
+def make_fixtures():
+    fixtures = []
+    for order in RU_NS_ORDERS:
+        authority = [("ru", QType.NS, 172800, f"{ns}.dns.ripn.net") for ns in order]
+        additional = [
+            (f"{ns}.dns.ripn.net", rtype, 172800, RU_GLUE[ns][i])
+            for i, rtype in enumerate((QType.A, QType.AAAA))
+            for ns in reversed(order)
+        ]
+        fixtures.append(encode_response("ya.ru", QType.A, authority=authority, additional=additional))
+    fixtures.append(encode_response(
+        "ya.ru", QType.A, answer=[("ya.ru", QType.A, 600, "87.250.250.242")], flags=0x8400
+    ))
+    fixtures.append(encode_response(
+        "noath-non-existent-domain.ru", QType.A,
+        authority=[("ru", QType.SOA, 3600, ("a.dns.ripn.net", "hostmaster.ripn.net", 4060283, 86400, 14400, 2592000, 3600))],
+        flags=0x8403,
+    ))
+    return fixtures
+
+def check_equivalence(fixtures):
+    for fixture in fixtures:
+        new = parse_dns_response(fixture)
+        old = legacy_parse_dns_response(binascii.hexlify(fixture).decode("utf-8"))
+        for section, records in (("ANSWER", new.answer), ("AUTHORITY", new.authority)):
+            assert [rr.name for rr in records] == [rr["NAME"] for rr in old[section]]
+        assert [(rr.name, rr.rdata) for rr in new.additional] == [
+            (rr["NAME"], rr["RDDATA"]) for rr in old["ADDITIONAL"]
+        ]
+        assert new.rcode == int(old["HEADER"]["RCODE"], 16)
+
+def main(repeat=FIXTURE_REPEAT):
+    fixtures = make_fixtures()
+    check_equivalence(fixtures)
+    hex_fixtures = [binascii.hexlify(fixture).decode("utf-8") for fixture in fixtures]
+
+    def run_legacy():
+        for fixture in hex_fixtures:
+            legacy_parse_dns_response(fixture)
+
+    def run_binary():
+        for fixture in fixtures:
+            parse_dns_response(fixture)
+
+    legacy_time = min(timeit.repeat(run_legacy, number=repeat, repeat=3))
+    binary_time = min(timeit.repeat(run_binary, number=repeat, repeat=3))
+    messages = repeat * len(fixtures)
+    print(f"{len(fixtures)} fixtures x {repeat} runs")
+    print(f"hex parser:    {1e6 * legacy_time / messages:8.2f} us/message")
+    print(f"binary parser: {1e6 * binary_time / messages:8.2f} us/message")
+    print(f"speedup:       {legacy_time / binary_time:8.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else FIXTURE_REPEAT)
@@ -0,0 +1,187 @@
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+import dns_resolver
+import json
+import logging
+import metrics
+import random
+import time
+import urllib.parse
+import urllib.request
+from benchmarks.hierarchy import CDN_ZONE, HOSTING_ZONE, Hierarchy
+from cache import Cache, DelegationCache
+from constants import MAX_STEPS
+from dns_parser import resolve_step
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from utils import Alias, NegativeAnswer, QType
+
+
+# Drives the resolver against benchmarks.hierarchy on loopback, either through
+# resolve_step directly, through lookup_records (cache included) or through the
+# HTTP API, with a Zipf query mix or a replayed query log. Every driver returns
+# the number of records found, so failed and negative lookups show up as empty
+# answers; errors are lookups that raised (or, for resolve_step, gave up).
+HTTP_ADDRESS = "127.0.0.1"
+HTTP_PORT = 5380
+MODES = ("step", "lookup", "http")
+
+
+def make_names(hierarchy, count, nxdomain, rng):
+    zones = sorted(zone for zone in hierarchy.zones if zone not in (HOSTING_ZONE, CDN_ZONE))
+    names = [
+        f"missing{i}.tld{i % len(hierarchy.tlds)}" if rng.random() < nxdomain else f"host{i}.{zones[i % len(zones)]}"
+        for i in range(count)
+    ]
+    rng.shuffle(names)  # popularity ranks should not follow the zone layout
+    return names
+
+def zipf_mix(names, queries, exponent, rng):
+    weights = [1 / rank ** exponent for rank in range(1, len(names) + 1)]
+    return rng.choices(names, weights=weights, k=queries)
+
+def replay_mix(path):
+    # one query per line, the domain being the first field (a plain list or a query log)
+    mix = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if fields and not fields[0].startswith("#"):
+                mix.append(fields[0].strip("."))
+    return mix
+
+def percentile(values, q):
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+def upstream_queries():
+    return sum(metrics.upstream_queries.values.values())
+
+def cache_lookups():
+    return dict(metrics.cache_lookups.values)
+
+
+def step_driver(hierarchy):
+    delegations = DelegationCache()
+
+    def resolve(domain):
+        roots = list(hierarchy.roots)
+        res_nodes = resolve_step(domain, roots, roots, [], 0, QType.A, hierarchy.port, MAX_STEPS, delegations)
+        if res_nodes is None:
+            raise RuntimeError(f"Failed to resolve {domain}")
+        if isinstance(res_nodes, NegativeAnswer):
+            return 0
+        return len(res_nodes.records if isinstance(res_nodes, Alias) else res_nodes)
+    return resolve
+
+def lookup_driver(hierarchy):
+    def resolve(domain):
+        return len(dns_resolver.lookup_records(domain)[0])
+    return resolve
+
+def http_driver(hierarchy):
+    server = WSGIServer((HTTP_ADDRESS, HTTP_PORT), dns_resolver.app, log=None)
+    server.start()
+
+    def resolve(domain):
+        query = urllib.parse.urlencode({"domain": domain, "format": "json"})
+        with urllib.request.urlopen(f"http://{HTTP_ADDRESS}:{HTTP_PORT}/get-records?{query}") as response:
+            return len(json.loads(response.read())["records"])
+    return resolve
+
+DRIVERS = {"step": step_driver, "lookup": lookup_driver, "http": http_driver}
+
+
+def reset_resolver(hierarchy, cache_size):
+    dns_resolver.ROOT_SERVERS = hierarchy.roots
+    dns_resolver.DNS_PORT = hierarchy.port
+    dns_resolver.app.config["cache"] = Cache(max_size=cache_size)
+    dns_resolver.app.config["delegations"] = DelegationCache()
+    dns_resolver.app.config["ipv6_support"] = False
+    dns_resolver.app.config["serve_stale"] = False
+
+def run(resolve, mix, concurrency):
+    latencies = []
+    errors = empty = 0
+
+    def timed(domain):
+        start = time.perf_counter()
+        try:
+            found = resolve(domain)
+        except Exception as e:
+            logging.error(f"Benchmark lookup of {domain} failed: {e}")
+            return None
+        return time.perf_counter() - start, found
+
+    pool = Pool(concurrency)
+    start = time.perf_counter()
+    for result in pool.imap_unordered(timed, mix):
+        if result is None:
+            errors += 1
+            continue
+        latencies.append(result[0])
+        empty += not result[1]
+    return sorted(latencies), errors, empty, time.perf_counter() - start
+
+def report(mode, mix, concurrency, latencies, errors, empty, elapsed, upstream, lookups):
+    hits = lookups.get(("hit",), 0) + lookups.get(("stale",), 0) + lookups.get(("negative",), 0)
+    total = sum(lookups.values())
+    print(f"{mode}: {len(mix)} queries over {len(set(mix))} names, concurrency {concurrency}")
+    print(f"  qps:                 {len(mix) / elapsed:10.1f}")
+    print(f"  latency p50:         {1e3 * percentile(latencies, 0.5):10.2f} ms")
+    print(f"  latency p99:         {1e3 * percentile(latencies, 0.99):10.2f} ms")
+    print(f"  upstream per lookup: {upstream / len(mix):10.2f}")
+    print(f"  cache hit ratio:     {hits / total:10.2f}" if total else "  cache hit ratio:            -")
+    print(f"  empty answers:       {empty:10d}")
+    print(f"  errors:              {errors:10d}")
+
+def main(args):
+    hierarchy = Hierarchy(
+        tlds=args.tlds, zones=args.zones, servers=args.servers, port=args.port, latency=args.latency / 1000,
+        loss=args.loss, glueless=args.glueless, truncation=args.truncation, cnames=args.cnames, ttl=args.ttl,
+    )
+    rng = random.Random(args.seed)
+    if args.replay:
+        mix = replay_mix(args.replay)
+    else:
+        mix = zipf_mix(make_names(hierarchy, args.names, args.nxdomain, rng), args.queries, args.zipf, rng)
+    logging.getLogger().setLevel(args.log_level)
+    hierarchy.start()
+    try:
+        for mode in args.mode:
+            reset_resolver(hierarchy, args.cache_size)
+            resolve = DRIVERS[mode](hierarchy)
+            upstream, lookups = upstream_queries(), cache_lookups()
+            latencies, errors, empty, elapsed = run(resolve, mix, args.concurrency)
+            lookups = {key: value - lookups.get(key, 0) for key, value in cache_lookups().items()}
+            upstream = upstream_queries() - upstream
+            report(mode, mix, args.concurrency, latencies, errors, empty, elapsed, upstream, lookups)
+    finally:
+        hierarchy.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolver benchmark against a fake DNS hierarchy on loopback")
+    parser.add_argument("--mode", nargs="+", choices=MODES, default=["lookup"], help="what to drive")
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--names", type=int, default=1000, help="distinct names in the Zipf mix")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of name popularity")
+    parser.add_argument("--nxdomain", type=float, default=0.05, help="share of names that do not exist")
+    parser.add_argument("--replay", metavar="PATH", help="replay domains from a query log instead of a Zipf mix")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--cache-size", type=int, default=-1)
+    parser.add_argument("--tlds", type=int, default=4)
+    parser.add_argument("--zones", type=int, default=400)
+    parser.add_argument("--servers", type=int, default=8, help="authoritative servers")
+    parser.add_argument("--latency", type=float, default=2.0, help="per-reply latency of every server, ms")
+    parser.add_argument("--loss", type=float, default=0.0, help="share of UDP replies dropped")
+    parser.add_argument("--glueless", type=float, default=0.1, help="share of zones delegated without glue")
+    parser.add_argument("--truncation", type=float, default=0.0, help="share of names answered with TC over UDP")
+    parser.add_argument("--cnames", type=float, default=0.3, help="share of names that are CNAMEs into a CDN zone")
+    parser.add_argument("--ttl", type=int, default=300)
+    parser.add_argument("--port", type=int, default=5300)
+    parser.add_argument("--seed", type=int, default=53)
+    parser.add_argument("--log-level", default="WARNING")
+    main(parser.parse_args())
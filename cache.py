@@ -1,62 +1,462 @@
+import heapq
 import logging
+import socket
+import struct
+import sys
 import time
-from collections import deque
+from collections import OrderedDict
+from utils import NegativeAnswer, QType, RCode, Site
+
+
+RECORD = struct.Struct("!dIB")  # expiration time, original TTL, address length
+# per-entry bookkeeping outside the entry object itself: the OrderedDict node
+# and hash slot, the expiry heap tuple and the use stamp
+ENTRY_OVERHEAD = 230
+NEGATIVE_ENTRY_OVERHEAD = 400
+ALIAS_ENTRY_OVERHEAD = 310
+
+
+def records_expiry(records):
+    # an entry lives until its first RRset (the A or the AAAA records) has fully
+    # expired, so a hit never silently lacks one address family
+    latest = {}
+    for site, expires in records:
+        family = ":" in site.ip
+        latest[family] = max(latest.get(family, expires), expires)
+    return min(latest.values(), default=0)
+
+def pack_records(domain, records):
+    # addresses are kept packed (4 or 16 bytes) in one blob per domain, owner
+    # names are only stored when some record is not owned by the domain itself
+    parts = []
+    names = []
+    for site, expires in records:
+        ip = socket.inet_pton(socket.AF_INET6 if ":" in site.ip else socket.AF_INET, site.ip)
+        parts += [RECORD.pack(expires, max(int(site.ttl), 0), len(ip)), ip]
+        names.append(site.url)
+    if all(name == domain for name in names):
+        return b"".join(parts), None
+    return b"".join(parts), tuple(sys.intern(name) for name in names)
+
+
+class CacheEntry:
+    __slots__ = ("expires", "hits", "records", "names", "used")
+
+    def __init__(self, domain, records, hits, used):
+        self.records, self.names = pack_records(domain, records)
+        self.expires = records_expiry(records)
+        self.hits = hits
+        self.used = used
+
+    def sites(self, domain):
+        sites = []
+        offset = 0
+        while offset < len(self.records):
+            expires, ttl, ip_length = RECORD.unpack_from(self.records, offset)
+            offset += RECORD.size
+            family = socket.AF_INET6 if ip_length == 16 else socket.AF_INET
+            ip = socket.inet_ntop(family, self.records[offset : offset + ip_length])
+            offset += ip_length
+            name = domain if self.names is None else self.names[len(sites)]
+            sites.append((Site(name, ip, ttl), expires))
+        return sites
+
+    def size(self, domain):
+        size = sys.getsizeof(self) + sys.getsizeof(self.records) + sys.getsizeof(domain) + ENTRY_OVERHEAD
+        if self.names is not None:
+            size += sys.getsizeof(self.names)
+        return size
+
+
+def negative_size(key):
+    return sys.getsizeof(key[0]) + NEGATIVE_ENTRY_OVERHEAD
+
+def alias_size(domain, target):
+    return sys.getsizeof(domain) + sys.getsizeof(target) + ALIAS_ENTRY_OVERHEAD
 
 
 class Cache:
-    def __init__(self, max_size=-1):
+    def __init__(self, max_size=-1, max_negative_size=None, max_stale=0, stale_ttl=30, max_bytes=None):
         self.max_size = max_size
-        self.cache = {}
-        self.key_queue = deque()
+        self.cache = OrderedDict()  # LRU order, least recently used first
+        self.expiry = []  # min-heap of (expiration time, domain), stale items are skipped lazily
+        # RFC 8767 serve-stale: expired entries are kept for max_stale more seconds
+        self.max_stale = max_stale
+        self.stale_ttl = stale_ttl
+        # RFC 2308 negative answers, keyed by (domain, qtype value); NXDOMAIN is stored with qtype 0
+        self.max_negative_size = max_size if max_negative_size is None else max_negative_size
+        self.negative = OrderedDict()  # key -> (expiration time, rcode, use stamp)
+        self.negative_expiry = []
+        self.negative_hits = 0
+        self.negative_misses = 0
+        # CNAME links, each under its own TTL; a chain is followed link by link, so
+        # aliases of one target share its cached records
+        self.aliases = OrderedDict()  # domain -> (expiration time, target, use stamp)
+        self.alias_expiry = []
+        # estimated memory of positive, negative and alias entries, all count against max_bytes
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.negative_bytes = 0
+        self.alias_bytes = 0
+        self.evictions = 0
+        # every entry is stamped on use, so the three LRU orders merge into one
+        self.clock = 0
+        # entries of a snapshot from the previous run are decoded on first access
+        self.snapshot = None
+
+    def over_budget(self, size):
+        return self.max_bytes is not None and self.bytes + self.negative_bytes + self.alias_bytes + size > self.max_bytes
+
+    def touch(self):
+        self.clock += 1
+        return self.clock
 
-    def add(self, domain, time, sites):
+    def make_room(self, size):
+        # the kinds share max_bytes, so the victim is the least recently used entry
+        # of any kind: the oldest of the heads of the three LRU orders
+        while self.over_budget(size):
+            heads = []
+            if self.cache:
+                domain = next(iter(self.cache))
+                heads.append((self.cache[domain].used, self.remove, domain))
+            if self.negative:
+                key = next(iter(self.negative))
+                heads.append((self.negative[key][2], self.remove_negative, key))
+            if self.aliases:
+                domain = next(iter(self.aliases))
+                heads.append((self.aliases[domain][2], self.remove_alias, domain))
+            if not heads:
+                return
+            _, remove, removed = min(heads, key=lambda head: head[0])
+            remove(removed)
+            self.evictions += 1
+            logging.info(f"Removing cache info for {removed} due to maximum memory of cache...")
+
+    def add(self, domain, timestamp, sites):
         if self.max_size == 0:  # no cache case
             return
-        if len(self.key_queue) >= self.max_size and self.max_size > 0:
-            removed = self.key_queue.popleft()
-            self.cache.pop(removed)
+        logging.info(f"Updating cache info for domain {domain}...")
+        records = [(site, timestamp + site.ttl) for site in sites]
+        previous = self.cache.get(domain)
+        hits = previous.hits // 2 if previous is not None else 0  # popularity decays on every refresh
+        if previous is not None:
+            # a lookup of one type replaces only its own RRset, the other one stays while it is valid
+            families = {":" in site.ip for site in sites}
+            now = time.time()
+            records += [
+                (site, expires) for site, expires in previous.sites(domain) if (":" in site.ip) not in families and expires >= now
+            ]
+        self.store(domain, records, hits)
+
+    def store(self, domain, records, hits):
+        domain = sys.intern(domain)
+        entry = CacheEntry(domain, records, hits, self.touch())
+        size = entry.size(domain)
+        if domain in self.cache:
+            self.remove(domain)
+        while self.cache and 0 < self.max_size <= len(self.cache):
+            removed = next(iter(self.cache))
+            self.remove(removed)
+            self.evictions += 1
             logging.info(
                 f"Removing cache info for domain {removed} due to maximum size of cache..."
             )
+        self.make_room(size)
 
-        logging.info(f"Updating cache info for domain {domain}...")
-        self.cache[domain] = {"TIME": time, "SITES": sites}
-        self.key_queue.append(domain)
+        self.cache[domain] = entry
+        self.bytes += size
+        heapq.heappush(self.expiry, (entry.expires, domain))
+        if len(self.expiry) > 2 * len(self.cache) + 64:
+            self.compact()
+
+    def remove(self, domain):
+        entry = self.cache.pop(domain)
+        self.bytes -= entry.size(domain)
+
+    def attach_snapshot(self, snapshot):
+        self.snapshot = snapshot
+
+    def detach_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def load(self, domain):
+        if self.snapshot is None or self.max_size == 0:
+            return None
+        found = self.snapshot.find(domain)
+        if found is None:
+            return None
+        hits, records = found
+        if records_expiry(records) + self.max_stale < time.time():
+            return None
+        logging.info(f"Loading cache info for domain {domain} from snapshot...")
+        self.store(domain, records, hits)
+        return self.cache[domain]
+
+    def snapshot_items(self):
+        # in-memory entries first, then the ones never loaded from the previous
+        # snapshot; only the keys are copied up front (lookups reorder the cache),
+        # records are decoded as the writer gets to them
+        domains = list(self.cache)
+        for domain in domains:
+            entry = self.cache.get(domain)
+            if entry is not None:  # evicted meanwhile
+                yield domain, entry.hits, entry.sites(domain)
+        if self.snapshot is None:
+            return
+        count = len(domains)
+        for domain, hits, records in self.snapshot.items():
+            if 0 < self.max_size <= count:
+                break
+            if domain not in self.cache:
+                count += 1
+                yield domain, hits, records
 
     def get(self, domain):
-        if domain in self.cache:
-            for site in self.cache[domain]["SITES"]:
-                if self.cache[domain]["TIME"] + site.ttl < time.time():
-                    logging.info(
-                        f"Removing cashed site for domain {domain} due to expiring..."
-                    )
-                    self.cache.pop(domain)
-                    try:
-                        self.key_queue.remove(domain)
-                    except ValueError as e:
-                        logging.error(
-                            f"Error occured while removing old cache for domain {domain}: {e}"
-                        )
-                    return None
-
-            logging.info(f"Using cashed site for domain {domain}...")
-            return self.cache[domain]["SITES"]
-        else:
+        entry = self.cache.get(domain)
+        if entry is None:
+            entry = self.load(domain)
+        if entry is None:
             logging.info(f"Domain {domain} did not found in cache.")
+            return None
+
+        now = time.time()
+        if entry.expires < now:
+            if entry.expires + self.max_stale < now:
+                logging.info(f"Removing cashed site for domain {domain} due to expiring...")
+                self.remove(domain)
+            return None
+
+        self.cache.move_to_end(domain)
+        entry.hits += 1
+        entry.used = self.touch()
+        logging.info(f"Using cashed site for domain {domain}...")
+        return [Site(site.url, site.ip, int(expires - now)) for site, expires in entry.sites(domain) if expires >= now]
+
+    def get_stale(self, domain):
+        entry = self.cache.get(domain)
+        if entry is None:
+            entry = self.load(domain)
+        if entry is None or entry.expires + self.max_stale < time.time():
+            return None
+        self.cache.move_to_end(domain)
+        entry.hits += 1
+        entry.used = self.touch()
+        logging.info(f"Using stale cashed site for domain {domain}...")
+        return [Site(site.url, site.ip, self.stale_ttl) for site, _ in entry.sites(domain)]
+
+    def prefetch_candidates(self, window, min_hits):
+        # walks only the part of the expiry heap that expires within `window` seconds
+        now = time.time()
+        bound = now + window
+        candidates = []
+        stack = [0] if self.expiry else []
+        while stack:
+            i = stack.pop()
+            expires, domain = self.expiry[i]
+            if expires > bound:
+                continue
+            entry = self.cache.get(domain)
+            if entry is not None and entry.expires == expires and expires >= now and entry.hits >= min_hits:
+                candidates.append(domain)
+            stack.extend(child for child in (2 * i + 1, 2 * i + 2) if child < len(self.expiry))
+        return candidates
+
+    def add_negative(self, domain, qtype, rcode, ttl, timestamp):
+        if self.max_negative_size == 0 or ttl <= 0:
+            return
+        key = (sys.intern(domain), 0 if rcode == RCode.NXDOMAIN else qtype.value)
+        size = negative_size(key)
+        if key in self.negative:
+            self.remove_negative(key)
+        while self.negative and 0 < self.max_negative_size <= len(self.negative):
+            removed = next(iter(self.negative))
+            self.remove_negative(removed)
+            self.evictions += 1
+            logging.info(
+                f"Removing negative cache info for {removed} due to maximum size of cache..."
+            )
+        self.make_room(size)
+
+        logging.info(f"Updating negative cache info for {key}...")
+        expires = timestamp + ttl
+        self.negative[key] = (expires, rcode, self.touch())
+        self.negative_bytes += size
+        heapq.heappush(self.negative_expiry, (expires, key))
+        if len(self.negative_expiry) > 2 * len(self.negative) + 64:
+            self.compact()
+
+    def remove_negative(self, key):
+        self.negative.pop(key)
+        self.negative_bytes -= negative_size(key)
+
+    def get_negative(self, domain, qtype):
+        now = time.time()
+        for key in ((domain, 0), (domain, qtype.value)):
+            entry = self.negative.get(key)
+            if entry is None:
+                continue
+            expires, rcode, _ = entry
+            if expires < now:
+                self.remove_negative(key)
+                continue
+            self.negative[key] = (expires, rcode, self.touch())
+            self.negative.move_to_end(key)
+            self.negative_hits += 1
+            logging.info(f"Using negative cache info for {key}...")
+            return NegativeAnswer(rcode, int(expires - now))
+        self.negative_misses += 1
         return None
 
+    def add_alias(self, domain, target, ttl, timestamp):
+        if self.max_size == 0 or ttl <= 0:
+            return
+        domain, target = sys.intern(domain), sys.intern(target)
+        size = alias_size(domain, target)
+        if domain in self.aliases:
+            self.remove_alias(domain)
+        while self.aliases and 0 < self.max_size <= len(self.aliases):
+            removed = next(iter(self.aliases))
+            self.remove_alias(removed)
+            self.evictions += 1
+            logging.info(
+                f"Removing alias info for domain {removed} due to maximum size of cache..."
+            )
+        self.make_room(size)
+
+        logging.info(f"Updating alias info for domain {domain}...")
+        expires = timestamp + ttl
+        self.aliases[domain] = (expires, target, self.touch())
+        self.alias_bytes += size
+        heapq.heappush(self.alias_expiry, (expires, domain))
+        if len(self.alias_expiry) > 2 * len(self.aliases) + 64:
+            self.compact()
+
+    def remove_alias(self, domain):
+        _, target, _ = self.aliases.pop(domain)
+        self.alias_bytes -= alias_size(domain, target)
+
+    def get_alias(self, domain):
+        entry = self.aliases.get(domain)
+        if entry is None:
+            return None
+        expires, target, _ = entry
+        now = time.time()
+        if expires < now:
+            logging.info(f"Removing alias info for domain {domain} due to expiring...")
+            self.remove_alias(domain)
+            return None
+        self.aliases[domain] = (expires, target, self.touch())
+        self.aliases.move_to_end(domain)
+        logging.info(f"Using cached alias {target} for domain {domain}...")
+        return target, int(expires - now)
+
+    def update(self):
+        now = time.time()
+        while self.expiry and self.expiry[0][0] + self.max_stale < now:
+            expires, domain = heapq.heappop(self.expiry)
+            entry = self.cache.get(domain)
+            if entry is not None and entry.expires == expires:
+                logging.info(f"Removing cashed site for domain {domain} due to expiring...")
+                self.remove(domain)
+        while self.negative_expiry and self.negative_expiry[0][0] < now:
+            expires, key = heapq.heappop(self.negative_expiry)
+            entry = self.negative.get(key)
+            if entry is not None and entry[0] == expires:
+                self.remove_negative(key)
+        while self.alias_expiry and self.alias_expiry[0][0] < now:
+            expires, domain = heapq.heappop(self.alias_expiry)
+            entry = self.aliases.get(domain)
+            if entry is not None and entry[0] == expires:
+                self.remove_alias(domain)
+
+    def compact(self):
+        self.expiry = [(entry.expires, domain) for domain, entry in self.cache.items()]
+        heapq.heapify(self.expiry)
+        self.negative_expiry = [(entry[0], key) for key, entry in self.negative.items()]
+        heapq.heapify(self.negative_expiry)
+        self.alias_expiry = [(entry[0], domain) for domain, entry in self.aliases.items()]
+        heapq.heapify(self.alias_expiry)
+
+    def memory_usage(self):
+        return {
+            "domains": len(self.cache),
+            "negative_entries": len(self.negative),
+            "bytes": self.bytes,
+            "negative_bytes": self.negative_bytes,
+            "negative_hits": self.negative_hits,
+            "negative_misses": self.negative_misses,
+            "aliases": len(self.aliases),
+            "alias_bytes": self.alias_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class DelegationCache:
+    def __init__(self):
+        self.zones = {}
+        self.glue = {}
+
+    def add(self, zone, ns_names, ttl, glue=()):
+        now = time.time()
+        logging.info(f"Updating delegation info for zone {zone}...")
+        self.zones[zone.lower()] = {"TIME": now + ttl, "NS": [ns_name.lower() for ns_name in ns_names]}
+        for ns_name, ip, ip_ttl in glue:
+            self.add_glue(ns_name, ip, ip_ttl, now)
+
+    def restore(self, zones, glue):
+        now = time.time()
+        for zone, expires, ns_names in zones:
+            if expires >= now:
+                self.zones[zone] = {"TIME": expires, "NS": ns_names}
+        for ns_name, ip, expires in glue:
+            if expires >= now:
+                self.glue.setdefault(ns_name, {})[ip] = expires
+
+    def add_glue(self, ns_name, ip, ttl, now=None):
+        now = time.time() if now is None else now
+        self.glue.setdefault(ns_name.lower(), {})[ip] = now + ttl
+
+    def addresses(self, ns_name, ipv6, now):
+        glue = self.glue.get(ns_name)
+        if not glue:
+            return []
+        return [ip for ip, expires in glue.items() if expires >= now and (":" in ip) == ipv6]
+
+    def closest(self, domain, qtype):
+        now = time.time()
+        ipv6 = qtype is QType.AAAA
+        labels = domain.lower().split(".")
+        for i in range(len(labels)):
+            zone = ".".join(labels[i:])
+            entry = self.zones.get(zone)
+            if entry is None:
+                continue
+            if entry["TIME"] < now:
+                logging.info(f"Removing delegation info for zone {zone} due to expiring...")
+                self.zones.pop(zone)
+                continue
+            nodes = [
+                Site(ns_name, ip)
+                for ns_name in entry["NS"]
+                for ip in self.addresses(ns_name, ipv6, now)
+            ]
+            if nodes:
+                return zone, nodes
+        return None, []
+
     def update(self):
-        for domain in self.cache:
-            for site in self.cache[domain]["SITES"]:
-                if self.cache[domain]["TIME"] + site.ttl < time.time():
-                    logging.info(
-                        f"Removing cashed site for domain {domain} due to expiring..."
-                    )
-                    self.cache.pop(domain)
-                    try:
-                        self.key_queue.remove(domain)
-                    except ValueError as e:
-                        logging.error(
-                            f"Error occured while removing old cache for domain {domain}: {e}"
-                        )
-                    return None
+        now = time.time()
+        for zone in [zone for zone, entry in self.zones.items() if entry["TIME"] < now]:
+            self.zones.pop(zone)
+        for ns_name in list(self.glue):
+            glue = {ip: expires for ip, expires in self.glue[ns_name].items() if expires >= now}
+            if glue:
+                self.glue[ns_name] = glue
+            else:
+                self.glue.pop(ns_name)
@@ -0,0 +1,49 @@
+import gevent
+import gevent.event
+import logging
+from constants import MAX_FLIGHT_WAIT
+
+
+ABANDONED = object()  # the leading greenlet was killed before it got a result
+
+
+class SingleFlight:
+    def __init__(self, timeout=MAX_FLIGHT_WAIT):
+        self.flights = {}
+        self.timeout = timeout
+
+    def do(self, key, fn, *args):
+        flight = self.flights.get(key)
+        while flight is not None:
+            logging.info(f"Waiting for in-flight resolution of {key}...")
+            try:
+                result = flight.get(timeout=self.timeout)
+            except gevent.Timeout:
+                # the leader may itself be waiting for us (lookups that need each other)
+                logging.warning(f"In-flight resolution of {key} takes too long, resolving it separately...")
+                return fn(*args)
+            if result is not ABANDONED:
+                return result
+            flight = self.flights.get(key)
+
+        flight = self.flights[key] = gevent.event.AsyncResult()
+        try:
+            result = fn(*args)
+        except gevent.GreenletExit:
+            flight.set(ABANDONED)
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set(result)
+            return result
+        finally:
+            if self.flights.get(key) is flight:
+                self.flights.pop(key)
+
+    def __len__(self):
+        return len(self.flights)
+
+
+flights = SingleFlight()
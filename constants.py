@@ -5,6 +5,7 @@ APP_ADDRESS = '127.0.0.1'
 APP_PORT = 5000
 DNS_PORT = 53
 MAX_STEPS = 16
+MAX_ALIASES = 8  # CNAME/DNAME links followed per lookup
 ROOT_SERVERS = (
     Site("a.root-servers.net", "198.41.0.4"),
     Site("b.root-servers.net", "199.9.14.201"),
@@ -21,3 +22,31 @@ ROOT_SERVERS = (
     Site("m.root-servers.net", "202.12.27.33"),
 )
 LOG_PATH = 'resolve.log'
+RACE_STAGGER = 0.2  # seconds before the next candidate nameserver is queried
+INITIAL_QUERY_TIMEOUT = 1.0  # seconds, for nameservers without RTT samples yet
+MIN_QUERY_TIMEOUT = 0.1
+MAX_QUERY_TIMEOUT = 3.0
+MIN_RACE_STAGGER = 0.02
+UNKNOWN_SERVER_RTT = 0.15  # assumed RTT when ordering servers never queried before
+MAX_SERVER_BACKOFF = 60.0
+MAX_STALE = 86400  # seconds an expired record may still be served with --serve-stale (RFC 8767)
+STALE_ANSWER_TTL = 30
+PREFETCH_INTERVAL = 5  # seconds between prefetch passes
+PREFETCH_WINDOW = 10  # refresh popular entries expiring within this many seconds
+PREFETCH_MIN_HITS = 3
+PREFETCH_CONCURRENCY = 16
+BATCH_CONCURRENCY = 64  # lookups in flight per /get-records/batch request
+MAX_BATCH_CONCURRENCY = 512
+DNS_SERVER_ADDRESS = '127.0.0.1'
+DNS_SERVER_PORT = 53
+DNS_SERVER_CONCURRENCY = 1024  # queries answered at once by the DNS frontend, over UDP and TCP together
+DNS_SERVER_TCP_CONNECTIONS = 256  # TCP connections served at once by the DNS frontend
+TCP_PIPELINE_DEPTH = 16  # queries of one TCP connection answered at once
+UDP_BATCH_SIZE = 64  # datagrams drained from the socket per wakeup
+TCP_IDLE_TIMEOUT = 10  # seconds, RFC 7766
+EDNS_PAYLOAD_SIZE = 1232  # largest UDP response we send to EDNS0 clients
+UDP_SOCKET_POOL_SIZE = 64  # idle upstream UDP sockets kept open per address family
+SNAPSHOT_INTERVAL = 300  # seconds between cache snapshots with --snapshot
+SHARED_CACHE_SIZE = 65536  # domains in the shared cache with --workers when no maximum is given
+MAX_FLIGHT_WAIT = 10  # seconds a lookup waits for an identical one in flight before resolving on its own
+TRACE_SAMPLE_RATE = 0.0  # share of resolutions whose every step is logged
@@ -1,200 +1,372 @@
+import functools
+import gevent
+import metrics
+import gevent.queue
 import logging
 import socket
-from utils import Section, Site, QType, make_dns_query, send_udp_message
+import struct
+import time
+from coalesce import flights
+from constants import EDNS_PAYLOAD_SIZE, MAX_ALIASES, RACE_STAGGER
+from nameservers import selector
+from tracing import tracer
+from transport import transport
+from utils import QUESTION_TAIL, Alias, Message, NegativeAnswer, QType, RCode, RR, Site, make_dns_query
+
+
+HEADER = struct.Struct("!HHHHHH")
+RR_HEADER = struct.Struct("!HHIH")
+SOA_TAIL = struct.Struct("!IIIII")
+MAX_POINTER_JUMPS = 64
+
+TYPE_A = QType.A.value
+TYPE_AAAA = QType.AAAA.value
+TYPE_SOA = QType.SOA.value
+TYPE_TXT = QType.TXT.value
+TYPE_CNAME = QType.CNAME.value
+TYPE_DNAME = QType.DNAME.value
+# nameservers are reached over IPv4, like the root servers, whichever type is asked for
+SERVER_QTYPE = QType.A
+NAME_TYPES = frozenset((QType.NS.value, TYPE_CNAME, 12, TYPE_DNAME))  # + PTR
+
+
+class ParseError(Exception):
+    pass
 
 
 def parse_rr_name(resp, begin):
-    i = end = begin
-    link = False
-    was_new_section = False
-    name = ""
-    while True:
-        byte = resp[i : i + 2]
-        i += 2
-        if byte == "00":
-            break
-        if int(byte, 16) >= int("c0", 16):  # offset
-            offset = int(resp[i - 2 : i + 2], 16) - int("c000", 16)
-            i = 2 * offset
-            if not link and was_new_section:
-                end += 2
-            link = True
-            continue
-        else:
-            was_new_section = True
-
-        url_section_len = int(byte, 16)
-        for _ in range(url_section_len):
-            byte = resp[i : i + 2]
-            symb = bytes.fromhex(byte).decode("utf-8")
-            name += symb
-            if not link:
-                end = i
-            i += 2
-
-        name += "."
-
-    if len(name) > 0 and name[-1] == ".":
-        name = name[:-1]
-    return name, end
-
-def parse_rr(resp, begin, section):
-    data = {}
-    name, end = parse_rr_name(resp, begin)
-    begin = end
-    data["NAME"] = name
-    data["TYPE"] = int(resp[begin + 4 : begin + 8], 16)
-    data["CLASS"] = int(resp[begin + 8 : begin + 12], 16)
-    data["TTL"] = int(resp[begin + 12 : begin + 20], 16)
-    data["RDLENGTH"] = int(resp[begin + 20 : begin + 24], 16)
-    rr_end = begin + 24 + data["RDLENGTH"] * 2
-
-    hex_rddata = resp[begin + 24 : rr_end]
-    if section is Section.ANSWER:
-        if data["TYPE"] == 1:
-            if data["RDLENGTH"] == 4:
-                data["RDDATA"] = socket.inet_ntop(
-                    socket.AF_INET, bytearray.fromhex(hex_rddata)
-                )
-            elif data["RDLENGTH"] == 16:
-                data["RDDATA"] = socket.inet_ntop(
-                    socket.AF_INET6, bytearray.fromhex(hex_rddata)
-                )
-        elif data["TYPE"] == 2 or data["TYPE"] == 16:
-            data["RDDATA"], _ = parse_rr_name(resp, begin + 24)
-        elif data["TYPE"] == 28:
-            data["RDDATA"] = socket.inet_ntop(
-                socket.AF_INET6, bytearray.fromhex(hex_rddata)
-            )
-    elif section is Section.AUTHORITY:
-        data["RDDATA"], _ = parse_rr_name(resp, begin + 24)
-    elif section is Section.ADDITIONAL:
-        if data["RDLENGTH"] == 4:
-            data["RDDATA"] = socket.inet_ntop(
-                socket.AF_INET, bytearray.fromhex(hex_rddata)
-            )
-        elif data["RDLENGTH"] == 16:
-            data["RDDATA"] = socket.inet_ntop(
-                socket.AF_INET6, bytearray.fromhex(hex_rddata)
-            )
-        else:
-            data["RDDATA"] = hex_rddata
-    else:
-        logging.error("Invalid section for RDDATA while RR parsing")
-        raise Exception("Invalid section for RDDATA while RR parsing")
+    labels = []
+    i = begin
+    end = None
+    jumps = 0
+    try:
+        while True:
+            length = resp[i]
+            if length >= 0xC0:  # offset
+                if end is None:
+                    end = i + 2
+                jumps += 1
+                offset = ((length & 0x3F) << 8) | resp[i + 1]
+                if jumps > MAX_POINTER_JUMPS or offset >= i:
+                    raise ParseError(f"Compression pointer loop at offset {i}")
+                i = offset
+                continue
+            if length > 63:
+                raise ParseError(f"Unsupported label type at offset {i}")
+            i += 1
+            if length == 0:
+                break
+            labels.append(resp[i : i + length])
+            i += length
+    except IndexError:
+        raise ParseError(f"Name at offset {begin} is out of message bounds")
+
+    if end is None:
+        end = i
+    return b".".join(labels).decode("utf-8", "replace"), end
 
-    return data, rr_end
+def parse_rdata(resp, begin, rtype, rdlength):
+    if rtype == TYPE_A and rdlength == 4:
+        return socket.inet_ntop(socket.AF_INET, resp[begin : begin + 4])
+    if rtype == TYPE_AAAA and rdlength == 16:
+        return socket.inet_ntop(socket.AF_INET6, resp[begin : begin + 16])
+    if rtype in NAME_TYPES:
+        return parse_rr_name(resp, begin)[0]
+    if rtype == TYPE_SOA:
+        mname, i = parse_rr_name(resp, begin)
+        rname, i = parse_rr_name(resp, i)
+        return (mname, rname) + SOA_TAIL.unpack_from(resp, i)
+    if rtype == TYPE_TXT:
+        strings = []
+        i, end = begin, begin + rdlength
+        while i < end:
+            strings.append(bytes(resp[i + 1 : i + 1 + resp[i]]))
+            i += 1 + resp[i]
+        return strings
+    return bytes(resp[begin : begin + rdlength])
+
+def parse_rr(resp, begin):
+    name, i = parse_rr_name(resp, begin)
+    try:
+        rtype, rclass, ttl, rdlength = RR_HEADER.unpack_from(resp, i)
+    except struct.error:
+        raise ParseError(f"Truncated resource record at offset {begin}")
+    i += RR_HEADER.size
+    rr_end = i + rdlength
+    if rr_end > len(resp):
+        raise ParseError(f"Truncated RDATA at offset {i}")
+    try:
+        rdata = parse_rdata(resp, i, rtype, rdlength)
+    except (IndexError, struct.error):
+        raise ParseError(f"Malformed RDATA at offset {i}")
+    return RR(name, rtype, rclass, ttl, rdata), rr_end
 
 def parse_dns_response(resp):
-    resp = resp.replace(" ", "").replace("\n", "")
-    data = {}
-
-    flags = bin(int(resp[4:8], 16))[2:].zfill(16)
-    data["HEADER"] = {
-        "ID": int(resp[:4], 16),
-        "QR": int(flags[0], 2),
-        "Opcode": "%0*X" % (1, int(flags[1:5], 2)),
-        "AA": int(flags[5], 2),
-        "TC": int(flags[6], 2),
-        "RD": int(flags[7], 2),
-        "RA": int(flags[8], 2),
-        "Z": flags[9:12],  # ignoring, must be zeros
-        "RCODE": "%0*X" % (1, int(flags[12:16], 2)),
-        "QDCOUNT": int(resp[8:12], 16),
-        "ANCOUNT": int(resp[12:16], 16),
-        "NSCOUNT": int(resp[16:20], 16),
-        "ARCOUNT": int(resp[20:24], 16),
-    }
-
-    # QUESTION (skip)
-    qname_end = resp.find("00", 24, len(resp))
-    if qname_end == -1:
+    try:
+        msg_id, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(resp, 0)
+    except struct.error:
         logging.error("Invalid header response.")
-        raise Exception("Invalid header response.")
-    q_end = 2 + qname_end + 8  # after qtype and qclass both
-
-    # ANSWER
-    data["ANSWER"] = []
-    rr_end = q_end
-    for _ in range(data["HEADER"]["ANCOUNT"]):
-        rr, rr_end = parse_rr(resp, rr_end, Section.ANSWER)
-        data["ANSWER"].append(rr)
-
-    # AUTHORITY
-    data["AUTHORITY"] = []
-    for _ in range(data["HEADER"]["NSCOUNT"]):
-        rr, rr_end = parse_rr(resp, rr_end, Section.AUTHORITY)
-        data["AUTHORITY"].append(rr)
-
-    # ADDITIONAL
-    data["ADDITIONAL"] = []
-    for _ in range(data["HEADER"]["ARCOUNT"]):
-        rr, rr_end = parse_rr(resp, rr_end, Section.ADDITIONAL)
-        data["ADDITIONAL"].append(rr)
-
-    return data
-
-def resolve_step(domain, node, root, trace, steps, qtype, dns_port, max_steps):
-    trace_repr = ' -> '.join(map(repr, trace))
-    logging.info(
-        f"Resolving step for domain {domain}, current trace is: {trace_repr}"
-    )
-    if steps > max_steps:
+        raise ParseError("Invalid header response.")
+
+    # QUESTION
+    question = []
+    i = HEADER.size
+    for _ in range(qdcount):
+        qname, i = parse_rr_name(resp, i)
+        try:
+            qtype, qclass = QUESTION_TAIL.unpack_from(resp, i)
+        except struct.error:
+            raise ParseError("Truncated question section.")
+        question.append((qname, qtype, qclass))
+        i += QUESTION_TAIL.size
+
+    # ANSWER, AUTHORITY, ADDITIONAL
+    sections = []
+    for count in (ancount, nscount, arcount):
+        records = []
+        for _ in range(count):
+            rr, i = parse_rr(resp, i)
+            records.append(rr)
+        sections.append(records)
+
+    return Message(msg_id, flags, question, *sections)
+
+def in_bailiwick(domain, zone):
+    return not zone or domain == zone or domain.endswith("." + zone)
+
+def referral_zone(domain, ns_rrs, zone):
+    # servers of a zone may only delegate a zone strictly below it, on the way to the
+    # queried name, so a referral never replaces a cut at or above the sender's zone
+    if not ns_rrs:
         return None
-    trace.append(node)
-        
-    message = make_dns_query(domain, qtype=qtype)
+    cut = ns_rrs[0].name.lower()
+    if cut == zone or not in_bailiwick(cut, zone) or not in_bailiwick(domain.lower(), cut):
+        logging.warning(f"Ignoring delegation to zone {cut} by servers of zone {zone or '.'} for domain {domain}")
+        return None
+    return cut
+
+def referral_glue(data, ns_names, zone):
+    # addresses of nameservers outside the sender's zone are not its to give (RFC 2181, 5.4.1)
+    return [
+        rr
+        for rr in data.additional
+        if rr.type in (TYPE_A, TYPE_AAAA) and rr.rdata and rr.name.lower() in ns_names and in_bailiwick(rr.name.lower(), zone)
+    ]
+
+def follow_aliases(domain, answer, zone=""):
+    # the CNAME chain starting at the queried name; a DNAME (RFC 6672) stands for
+    # the CNAME it would synthesize, in case the server did not include that one.
+    # Links owned by names outside the sender's zone are left to their own servers
+    cnames = {rr.name.lower(): rr for rr in answer if rr.type == TYPE_CNAME}
+    dnames = [rr for rr in answer if rr.type == TYPE_DNAME and in_bailiwick(rr.name.lower(), zone)]
+    links = []
+    name = domain
+    while len(links) < MAX_ALIASES and in_bailiwick(name.lower(), zone):
+        rr = cnames.get(name.lower())
+        if rr is not None:
+            target, ttl = rr.rdata, rr.ttl
+        else:
+            rr = next((rr for rr in dnames if name.lower().endswith("." + rr.name.lower())), None)
+            if rr is None:
+                break
+            target, ttl = name[: -len(rr.name)] + rr.rdata, rr.ttl
+        links.append((name, target, ttl))
+        name = target
+    return links
+
+def negative_ttl(data):
+    # RFC 2308, section 5: the lesser of the SOA TTL and the SOA MINIMUM field
+    for rr in data.authority:
+        if rr.type == TYPE_SOA:
+            return min(rr.ttl, rr.rdata[6])
+    return 0
+
+def is_nodata(data):
+    if data.answer or data.rcode != RCode.NOERROR:
+        return False
+    has_soa = has_ns = False
+    for rr in data.authority:
+        has_soa = has_soa or rr.type == TYPE_SOA
+        has_ns = has_ns or rr.type == QType.NS.value
+    return has_soa or (data.aa and not has_ns)
+
+def race(tasks, accept, staggers, cancel=True):
+    # start the tasks one by one, the next one either after the previous task's
+    # stagger or right after the previous task fails, return the first accepted result
+    results = gevent.queue.Queue()
+
+    def run(task):
+        try:
+            result = task()
+        except Exception as e:
+            logging.error(f"Error occured while racing queries: {e}")
+            result = None
+        results.put(result)
+
+    greenlets = []
+    received = 0
     try:
-        response = send_udp_message(message, node.ip, dns_port)
-    except OSError as e:
-        logging.error(f"Error occured while sending udp message: {e}")
+        for task, stagger in zip(tasks, staggers):
+            greenlets.append(gevent.spawn(run, task))
+            try:
+                result = results.get(timeout=stagger)
+            except gevent.queue.Empty:
+                continue
+            received += 1
+            if accept(result):
+                return result
+        while received < len(greenlets):
+            result = results.get()
+            received += 1
+            if accept(result):
+                return result
         return None
+    finally:
+        if cancel:
+            gevent.killall(greenlets, block=False)
 
-    data = parse_dns_response(response)
-    if data["HEADER"]["RCODE"] == '3': # NXDomain
-        logging.info(f"Got NXDomain while resolving domain {domain}")
+def query_server(domain, qtype, node, dns_port):
+    message = make_dns_query(domain, qtype, EDNS_PAYLOAD_SIZE)
+    start = time.monotonic()
+    metrics.upstream_in_flight.inc()
+    try:
+        response = transport.query(message, node.ip, dns_port, selector.timeout(node.ip))
+    except OSError as e:
+        logging.error(f"Error occured while querying {node}: {e}")
+        selector.record_failure(node.ip)
+        metrics.upstream_queries.inc(node.ip, "timeout" if isinstance(e, socket.timeout) else "error")
+        return None
+    finally:
+        metrics.upstream_in_flight.dec()
+    try:
+        data = parse_dns_response(response)
+    except ParseError as e:
+        logging.error(f"Error occured while parsing response from {node}: {e}")
+        selector.record_failure(node.ip)
+        metrics.upstream_queries.inc(node.ip, "malformed")
         return None
+    rtt = time.monotonic() - start
+    selector.record_rtt(node.ip, rtt)
+    metrics.upstream_queries.inc(node.ip, "ok")
+    metrics.upstream_rtt.observe(rtt)
+    return node, data
+
+def is_usable(result):
+    return result is not None and result[1].rcode in (RCode.NOERROR, RCode.NXDOMAIN)
+
+def query_servers(domain, qtype, nodes, dns_port):
+    nodes = selector.order(nodes)
+    tasks = [functools.partial(query_server, domain, qtype, node, dns_port) for node in nodes]
+    # losing queries are left to finish (they are bounded by their timeouts) to keep RTT samples
+    return race(tasks, is_usable, [selector.stagger(node.ip) for node in nodes], cancel=False)
+
+def resolve_glueless(ns_names, root, trace, steps, qtype, dns_port, max_steps, delegations=None, resolving=frozenset()):
+    # resolving holds the nameserver names this lookup is already resolving further
+    # up: a name that needs itself (an in-zone NS without glue, circular glueless
+    # delegations) is skipped instead of waiting for its own flight
+    ns_names = [ns_name for ns_name in ns_names if ns_name.lower() not in resolving]
+    traces = {ns_name: tracer.child(trace) for ns_name in ns_names}
 
-    if data["ANSWER"] and data["HEADER"]["AA"]:
-        return [Site(RR["NAME"], RR["RDDATA"], RR["TTL"]) for RR in data["ANSWER"]]
-
-    additional_info = {}
-    for add_rr in data["ADDITIONAL"]:
-        correct_IPv4 = add_rr["RDLENGTH"] == 4 and qtype is QType.A
-        correct_IPv6 = add_rr["RDLENGTH"] == 16 and qtype is QType.AAAA
-        if correct_IPv4 or correct_IPv6:
-            additional_info.update({add_rr["NAME"]: add_rr["RDDATA"]})
-
-    for ns_rr in data["AUTHORITY"]:
-        ns_name = ns_rr["RDDATA"]
-        inner_steps = 0
-        if ns_name in additional_info:
-            next_node = Site(ns_name, additional_info[ns_name])
-            next_nodes = [next_node]
+    def lookup(ns_name):
+        args = (
+            ns_name, root, root, traces[ns_name], steps, qtype, dns_port, max_steps, delegations, "",
+            resolving | {ns_name.lower()},
+        )
+        if delegations is None:  # trace walks must see every step themselves
+            next_nodes = resolve_step(*args)
         else:
-            next_nodes = resolve_step(ns_name, root, root, trace, steps + 1, qtype, dns_port, max_steps)
-            inner_steps = 1
-        if next_nodes is not None:
-            for next_node in next_nodes:
-                if next_node is not None:
-                    res_nodes = resolve_step(
-                        domain, next_node, root, trace, steps + 1 + inner_steps, qtype, dns_port, max_steps 
-                    )
-                    if res_nodes is not None:
-                        return res_nodes
-    return None
+            next_nodes = flights.do((ns_name.lower(), qtype), resolve_step, *args)
+        if isinstance(next_nodes, NegativeAnswer):
+            return None
+        if isinstance(next_nodes, Alias):  # not allowed for NS names (RFC 2181, 10.3), tolerated like most resolvers do
+            next_nodes = next_nodes.records
+        return ns_name, next_nodes
+
+    tasks = [functools.partial(lookup, ns_name) for ns_name in ns_names]
+    staggers = [RACE_STAGGER] * len(tasks)
+    result = race(tasks, lambda result: result is not None and bool(result[1]), staggers)
+    if result is None:
+        return None
+    ns_name, next_nodes = result
+    trace.extend(traces[ns_name])
+    if delegations is not None:
+        for next_node in next_nodes:
+            delegations.add_glue(ns_name, next_node.ip, next_node.ttl)
+    return next_nodes
 
+def resolve_step(
+    domain, node, root, trace, steps, qtype, dns_port, max_steps, delegations=None, zone="", resolving=frozenset()
+):
+    # zone is the one the queried servers are authoritative for, "" being the root
+    tracer.step(domain, trace)
+    if steps > max_steps:
+        return None
+    if delegations is not None and node is root:
+        cut, cut_nodes = delegations.closest(domain, SERVER_QTYPE)
+        if cut_nodes:
+            logging.info(f"Using cached delegation for zone {cut} while resolving domain {domain}...")
+            res_nodes = resolve_step(
+                domain, cut_nodes, root, trace, steps, qtype, dns_port, max_steps, delegations, cut, resolving
+            )
+            if res_nodes is not None:
+                return res_nodes
+
+    nodes = node if isinstance(node, (list, tuple)) else [node]
+    result = query_servers(domain, qtype, nodes, dns_port)
+    if result is None:
+        return None
+    answered, data = result
+    trace.append(answered)
+
+    # an NXDOMAIN or NODATA answer behind a CNAME is about its target, which is resolved on its own
+    links = follow_aliases(domain, data.answer, zone) if data.aa else []
+    if links:
+        target = links[-1][1].lower()
+        records = [
+            Site(rr.name, rr.rdata, rr.ttl)
+            for rr in data.answer
+            if rr.type == qtype.value and rr.name.lower() == target and in_bailiwick(target, zone)
+        ]
+        logging.info(f"Got CNAME chain {links} while resolving domain {domain}")
+        return Alias(links, records)
+
+    if data.rcode == RCode.NXDOMAIN:
+        logging.info(f"Got NXDomain while resolving domain {domain}")
+        return NegativeAnswer(RCode.NXDOMAIN, negative_ttl(data))
+    if is_nodata(data):
+        logging.info(f"Got NODATA while resolving domain {domain}")
+        return NegativeAnswer(RCode.NOERROR, negative_ttl(data))
+
+    if data.answer and data.aa:
+        return [Site(rr.name, rr.rdata, rr.ttl) for rr in data.answer if rr.type == qtype.value]
+
+    ns_rrs = [rr for rr in data.authority if rr.type == QType.NS.value]
+    cut = referral_zone(domain, ns_rrs, zone)
+    if cut is None:
+        return None
+    ns_rrs = [rr for rr in ns_rrs if rr.name.lower() == cut]
+    ns_names = list(dict.fromkeys(rr.rdata.lower() for rr in ns_rrs))
+    glue = referral_glue(data, ns_names, zone)
+    if delegations is not None:
+        glue_records = [(rr.name, rr.rdata, rr.ttl) for rr in glue]
+        delegations.add(cut, ns_names, min(rr.ttl for rr in ns_rrs), glue_records)
 
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'f.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'f.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'a.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'a.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'a.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}]}
-{'HEADER': {'ID': 43690, 'QR': 1, 'Opcode': '0', 'AA': 0, 'TC': 0, 'RD': 0, 'RA': 0, 'Z': '000', 'RCODE': '0', 'QDCOUNT': 1, 'ANCOUNT': 0, 'NSCOUNT': 5, 'ARCOUNT': 10}, 'ANSWER': [], 'AUTHORITY': [{'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': 'd.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'b.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'e.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'a.dns.ripn.net'}, {'NAME': 'ru', 'TYPE': 2, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': 'f.dns.ripn.net'}], 'ADDITIONAL': [{'NAME': 'f.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.156.17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.142.17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.190.124.17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '194.85.252.62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 1, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 4, 'RDDATA': '193.232.128.6'}, {'NAME': 'f.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:14:0:193:232:156:17'}, {'NAME': 'e.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:15:0:193:232:142:17'}, {'NAME': 'd.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:18:0:194:190:124:17'}, {'NAME': 'b.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:16:0:194:85:252:62'}, {'NAME': 'a.dns.ripn.net', 'TYPE': 28, 'CLASS': 1, 'TTL': 172800, 'RDLENGTH': 16, 'RDDATA': '2001:678:17:0:193:232:128:6'}]}
\ No newline at end of file
+    glued = [Site(rr.name, rr.rdata) for rr in glue if rr.type == SERVER_QTYPE.value]
+    if glued:
+        res_nodes = resolve_step(
+            domain, glued, root, trace, steps + 1, qtype, dns_port, max_steps, delegations, cut, resolving
+        )
+        if res_nodes is not None:
+            return res_nodes
+
+    glued_names = {site.url.lower() for site in glued}
+    glueless = [ns_name for ns_name in ns_names if ns_name not in glued_names]
+    if glueless:
+        next_nodes = resolve_glueless(
+            glueless, root, trace, steps + 1, SERVER_QTYPE, dns_port, max_steps, delegations, resolving
+        )
+        if next_nodes:
+            return resolve_step(
+                domain, next_nodes, root, trace, steps + 2, qtype, dns_port, max_steps, delegations, cut, resolving
+            )
+    return None
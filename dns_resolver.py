@@ -1,13 +1,52 @@
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+import gevent
+import json
 import logging
+import metrics
+import signal
 import sys
 import time
-from cache import Cache
-from constants import APP_ADDRESS, APP_PORT, DNS_PORT, MAX_STEPS, LOG_PATH, ROOT_SERVERS
+from cache import Cache, DelegationCache
+from coalesce import flights
+from constants import (
+    APP_ADDRESS,
+    APP_PORT,
+    BATCH_CONCURRENCY,
+    DNS_PORT,
+    DNS_SERVER_ADDRESS,
+    DNS_SERVER_PORT,
+    LOG_PATH,
+    MAX_ALIASES,
+    MAX_BATCH_CONCURRENCY,
+    MAX_QUERY_TIMEOUT,
+    MAX_STALE,
+    MAX_STEPS,
+    PREFETCH_CONCURRENCY,
+    PREFETCH_INTERVAL,
+    PREFETCH_MIN_HITS,
+    PREFETCH_WINDOW,
+    ROOT_SERVERS,
+    SHARED_CACHE_SIZE,
+    SNAPSHOT_INTERVAL,
+    STALE_ANSWER_TTL,
+    TRACE_SAMPLE_RATE,
+)
 from distutils.util import strtobool
 from dns_parser import resolve_step
-from flask import Flask, request
+from dns_server import DNSServer
+from flask import Flask, Response, jsonify, request, stream_with_context
+from gevent.pool import Pool
 from gevent.pywsgi import WSGIServer
-from utils import QType, check_IPv6_support
+from nameservers import selector
+from shared_cache import SharedCache, SharedTable
+from snapshot import load_snapshot, write_snapshot
+from tracing import tracer
+from utils import Alias, NegativeAnswer, QType, RCode, check_IPv6_support
+from workers import fork_workers, reuse_port_socket
 
 
 logging.basicConfig(level=logging.INFO, filename=LOG_PATH, filemode="w")
@@ -24,18 +63,256 @@ def update_cache():
     try:
         cache = app.config["cache"]
         cache.update()
+        app.config["delegations"].update()
         return "Cache updated"
     except Exception as e:
         logging.error(f"Error occured while updating cache: {e}")
         return "Failed to update cache"
 
 
+@app.before_request
+def count_request():
+    metrics.requests_in_flight.inc("http")
+
+
+@app.teardown_request
+def uncount_request(exception=None):
+    metrics.requests_in_flight.dec("http")
+
+
+def collect_metrics():
+    usage = app.config["cache"].memory_usage()
+    metrics.cache_evictions.set(usage["evictions"])
+    metrics.negative_lookups.set(usage["negative_hits"], "hit")
+    metrics.negative_lookups.set(usage["negative_misses"], "miss")
+    metrics.cache_entries.set(usage["domains"], "positive")
+    metrics.cache_entries.set(usage["negative_entries"], "negative")
+    metrics.cache_entries.set(usage["aliases"], "alias")
+    metrics.cache_bytes.set(usage["bytes"] + usage["negative_bytes"] + usage["alias_bytes"])
+    for ip, stats in selector.stats.items():
+        if stats.srtt is not None:
+            metrics.upstream_srtt.set(stats.srtt, ip)
+    metrics.resolutions_in_flight.set(len(flights))
+
+
+metrics.registry.add_collector(collect_metrics)
+
+
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache-stats", methods=['GET'])
+def cache_stats():
+    return jsonify(app.config["cache"].memory_usage())
+
+
+def resolve_records(domain, qtypes, cache, delegations):
+    logging.info(f"Starting resolving for domain {domain}...")
+    resolve_start_time = time.time()
+    roots = list(ROOT_SERVERS)
+    traces = {qtype: tracer.start() for qtype in qtypes}
+    jobs = {
+        qtype: gevent.spawn(resolve_step, domain, roots, roots, traces[qtype], 0, qtype, DNS_PORT, MAX_STEPS, delegations)
+        for qtype in qtypes
+    }
+    gevent.joinall(list(jobs.values()))
+
+    trace = []
+    res_nodes = []
+    negatives = {}
+    aliases = []
+    for qtype, job in jobs.items():
+        trace += traces[qtype]
+        if job.exception is not None:
+            if qtype is not QType.AAAA:
+                raise job.exception
+            logging.error(
+                f"Error occured while resolving IPv6. Probably your net has no IPv6 support. Exception: {job.exception}"
+            )
+            continue
+        if job.value is not None:
+            metrics.recursion_depth.observe(len(traces[qtype]))
+        if isinstance(job.value, NegativeAnswer):
+            negatives[qtype] = job.value
+        elif isinstance(job.value, Alias):
+            aliases.append(job.value)
+        elif job.value:
+            res_nodes += job.value
+
+    # records found behind a CNAME chain are cached under its target, not under the alias
+    targets = {}
+    for alias in aliases:
+        targets.setdefault(alias.target, []).extend(alias.records)
+    if res_nodes or negatives or aliases:
+        logging.info(f"Resolving finished for domain {domain}...")
+        logging.info(f"Updating cache for domain {domain}...")
+        if res_nodes:
+            cache.add(domain, resolve_start_time, res_nodes)
+        for qtype, negative in negatives.items():
+            cache.add_negative(domain, qtype, negative.rcode, negative.ttl, resolve_start_time)
+        for alias in aliases:
+            for name, target, ttl in alias.links:
+                cache.add_alias(name, target, ttl, resolve_start_time)
+        for target, records in targets.items():
+            if records:
+                cache.add(target, resolve_start_time, records)
+
+    if not aliases:
+        return res_nodes, trace, [], negatives
+    links = aliases[0].links
+    return res_nodes + targets[links[-1][1]], trace, links, negatives
+
+
+def default_qtypes():
+    return [QType.A, QType.AAAA] if app.config["ipv6_support"] else [QType.A]
+
+
+def refresh_records(domain, cache, delegations):
+    qtypes = default_qtypes()
+    try:
+        flights.do((domain, tuple(qtypes)), resolve_records, domain, qtypes, cache, delegations)
+    except Exception as e:
+        logging.error(f"Error occured while refreshing domain {domain}: {e}")
+
+
+def prefetch_forever(cache, delegations):
+    pool = Pool(PREFETCH_CONCURRENCY)
+    while True:
+        gevent.sleep(PREFETCH_INTERVAL)
+        for domain in cache.prefetch_candidates(PREFETCH_WINDOW, PREFETCH_MIN_HITS):
+            logging.info(f"Prefetching popular domain {domain}...")
+            pool.spawn(refresh_records, domain, cache, delegations)
+
+
+def save_snapshot(path, cache, delegations):
+    try:
+        write_snapshot(path, cache, delegations)
+    except OSError as e:
+        logging.error(f"Error occured while saving cache snapshot {path}: {e}")
+
+
+def snapshot_forever(path, cache, delegations):
+    while True:
+        gevent.sleep(SNAPSHOT_INTERVAL)
+        save_snapshot(path, cache, delegations)
+
+
+def lookup_records(domain, trace_flag=False, qtypes=None):
+    start = time.monotonic()
+    status = "error"
+    try:
+        res_nodes, trace, status, aliases, negatives = find_records(domain, trace_flag, qtypes)
+    finally:
+        metrics.cache_lookups.inc(status)
+        metrics.lookup_latency.observe(time.monotonic() - start, status)
+    return res_nodes, trace, status, aliases, negatives
+
+
+def find_records(domain, trace_flag, qtypes=None):
+    # CNAME chains are followed link by link, so every alias on the way and the
+    # records of its target are served from the cache when they are there; the
+    # negative answers are the ones of the last name
+    trace = []
+    aliases = []
+    statuses = set()
+    name = domain
+    while True:
+        res_nodes, name_trace, status, links, negatives = find_name_records(name, trace_flag, qtypes)
+        trace += name_trace
+        statuses.add(status)
+        aliases += links
+        if res_nodes or not links:
+            break
+        if len(aliases) >= MAX_ALIASES:
+            logging.error(f"CNAME chain for domain {domain} is longer than {MAX_ALIASES} links, giving up")
+            break
+        name = links[-1][1]
+    return res_nodes, trace, "miss" if "miss" in statuses else status, aliases, negatives
+
+
+def has_records(sites, qtype):
+    return any((":" in site.ip) == (qtype is QType.AAAA) for site in sites)
+
+
+def find_name_records(domain, trace_flag, qtypes=None):
+    # the cache answers only when every qtype is covered, by its own RRset or by a
+    # negative entry: a lookup of one type (the DNS frontend) may have cached one
+    # address family only, the other one is then resolved
+    cache = app.config["cache"]
+    qtypes = default_qtypes() if qtypes is None else qtypes
+    cached = []
+    negatives = {}
+    if not trace_flag:
+        cached = cache.get(domain) or []
+        if not cached:
+            alias = cache.get_alias(domain)
+            if alias is not None:
+                return [], [], "hit", [(domain, *alias)], {}
+        for qtype in qtypes:
+            negative = None if has_records(cached, qtype) else cache.get_negative(domain, qtype)
+            if negative is not None:
+                negatives[qtype] = negative
+        qtypes = [qtype for qtype in qtypes if not has_records(cached, qtype) and qtype not in negatives]
+        if not qtypes:
+            return cached, [], "hit" if cached else "negative", [], negatives
+        stale = cache.get_stale(domain) if not cached and app.config["serve_stale"] else None
+        if stale and all(has_records(stale, qtype) for qtype in qtypes):
+            gevent.spawn(refresh_records, domain, cache, app.config["delegations"])
+            return stale, [], "stale", [], negatives
+    delegations = None if trace_flag else app.config["delegations"]
+
+    if trace_flag:
+        res_nodes, trace, links, resolved = resolve_records(domain, qtypes, cache, delegations)
+    else:
+        res_nodes, trace, links, resolved = flights.do(
+            (domain, tuple(qtypes)), resolve_records, domain, qtypes, cache, delegations
+        )
+    negatives.update(resolved)
+    return cached + res_nodes, trace, "miss", links, negatives
+
+
+def answer_query(domain, qtype):
+    domain = domain.strip('.')
+    if not domain:
+        return [], RCode.NOERROR, []
+    res_nodes, _, status, aliases, negatives = lookup_records(domain, qtypes=[qtype])
+    records = [site for site in res_nodes if (":" in site.ip) == (qtype is QType.AAAA)]
+    if records:
+        return records, RCode.NOERROR, aliases
+    # a negative answer behind a CNAME chain is about the last target
+    negative = negatives.get(qtype)
+    if negative is not None:
+        return [], negative.rcode, aliases
+    if status == "miss" and not res_nodes:
+        return [], RCode.SERVFAIL, aliases
+    return [], RCode.NOERROR, aliases
+
+
+def records_to_json(domain, records, status, trace=None, error=None, aliases=()):
+    result = {
+        "domain": domain,
+        "status": status,
+        "records": [
+            {"name": site.url, "type": "AAAA" if ":" in site.ip else "A", "address": site.ip, "ttl": site.ttl}
+            for site in records
+        ],
+    }
+    if aliases:
+        result["aliases"] = [{"name": name, "target": target, "ttl": ttl} for name, target, ttl in aliases]
+    if trace is not None:
+        result["trace"] = [{"name": site.url, "address": site.ip} for site in trace]
+    if error is not None:
+        result["error"] = error
+    return result
+
+
 @app.route("/get-records", methods=['GET'])
 def get_records():
     ipv_string = "Using IPv4 " + (
         "and IPv6 both.<br/><br/>" if app.config["ipv6_support"] else "only.<br/><br/>"
     )
-    cache = app.config["cache"]
     domain = request.args.get("domain").strip('.')
     if len(domain) == 0:
         logging.error("Empty domain")
@@ -46,42 +323,17 @@ def get_records():
     except Exception as e:
         logging.error(f"Error occured while converting trace argument to bool: {e}")
         trace_flag = False
-    if not trace_flag:
-        cached = cache.get(domain)
-        if cached is not None:
-            return (
-                ipv_string
-                + "Using cached record:<br/>"
-                + "<br/>".join(map(repr, cached))
-            )
 
-    logging.info(f"Starting resolving for domain {domain}...")
-    resolve_start_time = time.time()
-    for root in ROOT_SERVERS:
-        trace = []
-
-        res_nodes_ipv4 = resolve_step(domain, root, root, trace, 0, QType.A, DNS_PORT, MAX_STEPS )
-        res_nodes_ipv4 = res_nodes_ipv4 if res_nodes_ipv4 is not None else []
-
-        if app.config["ipv6_support"]:
-            try:
-                res_nodes_ipv6 = resolve_step(domain, root, root, trace, 0, QType.AAAA, DNS_PORT, MAX_STEPS )
-                res_nodes_ipv6 = res_nodes_ipv6 if res_nodes_ipv6 is not None else []
-            except Exception as e:
-                logging.error(
-                    f"Error occured while resolving IPv6. Probably your net has no IPv6 support. Exception: {e}"
-                )
-                res_nodes_ipv6 = []
-        else:
-            res_nodes_ipv6 = []
-
-        res_nodes = res_nodes_ipv4 + res_nodes_ipv6
-        if res_nodes:
-            logging.info(f"Resolving finished for domain {domain}...")
-            logging.info(f"Updating cache for domain {domain}...")
-            cache.add(domain, resolve_start_time, res_nodes)
-            break
+    res_nodes, trace, status, aliases, _ = lookup_records(domain, trace_flag)
 
+    if request.args.get("format") == "json":
+        return jsonify(records_to_json(domain, res_nodes, status, trace if trace_flag else None, aliases=aliases))
+    if aliases:
+        ipv_string += "Aliases:<br/>" + "<br/>".join(f"{name} -> {target}" for name, target, _ in aliases) + "<br/><br/>"
+    if status == "hit":
+        return ipv_string + "Using cached record:<br/>" + "<br/>".join(map(repr, res_nodes))
+    if status == "stale":
+        return ipv_string + "Using stale cached record:<br/>" + "<br/>".join(map(repr, res_nodes))
     if trace_flag:
         return (
             ipv_string
@@ -93,15 +345,138 @@ def get_records():
     return ipv_string + "<br/>".join(map(repr, res_nodes)) if res_nodes else 'There are not A or AAAA records for this domain.'
 
 
-if __name__ == "__main__":
+def parse_batch_item(item):
+    if isinstance(item, dict):
+        item = item.get("domain")
+    if not isinstance(item, str):
+        raise ValueError("expected a domain string or an object with a \"domain\" string")
+    return item
+
+
+def parse_batch_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    if line[:1] in (b'"', b"{"):
+        return parse_batch_item(json.loads(line))
+    return line.decode("utf-8")
+
+
+def batch_items(items):
+    # items of a JSON list body, checked like NDJSON lines
+    for item in items:
+        try:
+            yield parse_batch_item(item)
+        except ValueError as e:
+            logging.error(f"Malformed item in batch request: {e}")
+            yield e
+
+
+def batch_domains(stream):
+    # NDJSON or plain text, one domain per line, read as the body arrives; a
+    # malformed line is passed on as its error, to be answered in its place
+    for line in stream:
+        try:
+            domain = parse_batch_line(line)
+        except ValueError as e:  # JSONDecodeError and UnicodeDecodeError included
+            logging.error(f"Malformed line in batch request: {e}")
+            yield e
+            continue
+        if domain is not None:
+            yield domain
+
+
+def batch_lookup(domain):
+    if isinstance(domain, ValueError):
+        return records_to_json("", [], "error", error=f"Malformed item: {domain}")
+    domain = domain.strip().strip('.')
+    if not domain:
+        return records_to_json(domain, [], "error", error="Empty domain")
     try:
-        max_cache_size = int(sys.argv[1]) if len(sys.argv) > 1 else -1
+        res_nodes, _, status, aliases, _ = lookup_records(domain)
     except Exception as e:
-        logging.error(f"Error occured while parsing argv: {e}")
-        max_cache_size = -1
-    app.config["cache"] = Cache(max_size=max_cache_size)
-    app.config["ipv6_support"] = check_IPv6_support(DNS_PORT)
+        logging.error(f"Error occured while resolving domain {domain} in batch: {e}")
+        return records_to_json(domain, [], "error", error=str(e))
+    return records_to_json(domain, res_nodes, status, aliases=aliases)
+
+
+@app.route("/get-records/batch", methods=['POST'])
+def get_records_batch():
+    try:
+        concurrency = int(request.args.get("concurrency", BATCH_CONCURRENCY))
+    except ValueError:
+        concurrency = BATCH_CONCURRENCY
+    pool = Pool(min(max(concurrency, 1), MAX_BATCH_CONCURRENCY))
+    # the domains are consumed from a pool greenlet, outside of the request context
+    if request.mimetype == "application/json":
+        body = request.get_json(silent=True)
+        domains = body.get("domains") if isinstance(body, dict) else body
+        if not isinstance(domains, list):
+            return jsonify({"error": 'Expected a list of domains or an object with a "domains" list'}), 400
+        domains = batch_items(domains)
+    else:
+        domains = batch_domains(request.stream)
+
+    def generate():
+        for result in pool.imap_unordered(batch_lookup, domains):
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recursive DNS resolver")
+    parser.add_argument("max_cache_size", nargs="?", type=int, default=-1, help="maximum number of cached domains")
+    parser.add_argument("--negative-cache-size", type=int, metavar="N", help="maximum number of cached negative answers (max_cache_size by default)")
+    parser.add_argument("--serve-stale", action="store_true", help="answer with expired records while refreshing them (RFC 8767)")
+    parser.add_argument("--no-prefetch", action="store_true", help="do not refresh popular records before they expire")
+    parser.add_argument("--cache-memory", type=float, metavar="MB", help="memory budget of the cache in megabytes")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes sharing the ports and the cache")
+    parser.add_argument("--snapshot", metavar="PATH", help="restore the cache from this file on start and save it there periodically and on shutdown")
+    parser.add_argument("--trace-sample", type=float, default=TRACE_SAMPLE_RATE, metavar="RATE", help="share of resolutions logged step by step")
+    parser.add_argument("--dns", action="store_true", help="also answer DNS queries over UDP and TCP")
+    parser.add_argument("--dns-port", type=int, default=DNS_SERVER_PORT, help="port of the DNS frontend")
+    args = parser.parse_args()
+    tracer.sample_rate = args.trace_sample
+    max_stale = MAX_STALE if args.serve_stale else 0
+    max_bytes = None if args.cache_memory is None else int(args.cache_memory * 1024 * 1024)
+    cache_options = dict(
+        max_size=args.max_cache_size,
+        max_negative_size=args.negative_cache_size,
+        max_stale=max_stale,
+        stale_ttl=STALE_ANSWER_TTL,
+        max_bytes=max_bytes,
+    )
+    app.config["ipv6_support"] = check_IPv6_support(DNS_PORT, MAX_QUERY_TIMEOUT)
+    app.config["serve_stale"] = args.serve_stale
+    worker = 0
+    if args.workers > 1:
+        table = SharedTable(args.max_cache_size if args.max_cache_size > 0 else SHARED_CACHE_SIZE)
+        worker = fork_workers(args.workers)
+        if worker is None:
+            sys.exit(0)
+        app.config["cache"] = SharedCache(table, **cache_options)
+    else:
+        app.config["cache"] = Cache(**cache_options)
+    app.config["delegations"] = DelegationCache()
+    if args.snapshot:
+        load_snapshot(args.snapshot, app.config["cache"], app.config["delegations"])
+        if worker == 0:  # the first worker saves the shared cache for everyone
+            gevent.spawn(snapshot_forever, args.snapshot, app.config["cache"], app.config["delegations"])
+    if not args.no_prefetch and worker == 0:  # refreshed records reach the other workers through the shared cache
+        gevent.spawn(prefetch_forever, app.config["cache"], app.config["delegations"])
+    if args.dns:
+        DNSServer(DNS_SERVER_ADDRESS, args.dns_port, answer_query).start(reuse_port=args.workers > 1)
+        print(f'Answering DNS queries on {DNS_SERVER_ADDRESS}:{args.dns_port}...')
     # app.run(debug=False, port=APP_PORT)
-    http_server = WSGIServer((APP_ADDRESS, APP_PORT), app)
-    print(f'Serving on {APP_ADDRESS}:{APP_PORT}...')
-    http_server.serve_forever()
+    listener = reuse_port_socket(APP_ADDRESS, APP_PORT) if args.workers > 1 else (APP_ADDRESS, APP_PORT)
+    http_server = WSGIServer(listener, app)
+    gevent.signal_handler(signal.SIGTERM, http_server.stop)
+    print(f'Serving on {APP_ADDRESS}:{APP_PORT} (worker {worker})...' if args.workers > 1 else f'Serving on {APP_ADDRESS}:{APP_PORT}...')
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.snapshot and worker == 0:
+            save_snapshot(args.snapshot, app.config["cache"], app.config["delegations"])
@@ -0,0 +1,206 @@
+import gevent
+import gevent.lock
+import gevent.socket
+import logging
+import metrics
+import socket
+import struct
+from constants import (
+    DNS_SERVER_CONCURRENCY, DNS_SERVER_TCP_CONNECTIONS, EDNS_PAYLOAD_SIZE, TCP_IDLE_TIMEOUT, TCP_PIPELINE_DEPTH,
+    UDP_BATCH_SIZE,
+)
+from dns_parser import HEADER, RR_HEADER, ParseError, parse_dns_response, parse_rr_name
+from gevent.pool import Pool
+from gevent.server import StreamServer
+from transport import TCP_LENGTH, receive_exactly
+from utils import QUESTION_TAIL, TYPE_OPT, UDP_RECEIVE_SIZE, QType, RCode, encode_name, make_opt_record
+from workers import reuse_port_socket
+
+
+POINTER = struct.Struct("!H")
+CLASSIC_UDP_SIZE = 512  # RFC 1035, section 4.2.1, for clients without EDNS0
+MAX_TCP_SIZE = 0xFFFF
+
+FLAG_QR = 0x8000
+FLAG_OPCODE = 0x7800
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+FLAG_RA = 0x0080
+
+QNAME_POINTER = b"\xc0\x0c"  # the question name always starts right after the header
+OPT_RR = make_opt_record(EDNS_PAYLOAD_SIZE)
+
+
+def encode_answer(site, qtype, owner=QNAME_POINTER):
+    family = socket.AF_INET6 if qtype is QType.AAAA else socket.AF_INET
+    rdata = socket.inet_pton(family, site.ip)
+    return owner + RR_HEADER.pack(qtype.value, 1, max(int(site.ttl), 0), len(rdata)) + rdata
+
+def encode_answers(records, qtype, aliases, offset):
+    # the CNAME chain goes first, every owner name points at the previous target;
+    # offset is where the answer section starts
+    answers = []
+    owner = QNAME_POINTER
+    for _, target, ttl in aliases:
+        rdata = encode_name(target)
+        answers.append(owner + RR_HEADER.pack(QType.CNAME.value, 1, max(int(ttl), 0), len(rdata)) + rdata)
+        owner = POINTER.pack(0xC000 | (offset + len(owner) + RR_HEADER.size))
+        offset += len(answers[-1])
+    return answers + [encode_answer(site, qtype, owner) for site in records]
+
+def make_response(query, question, rcode, answers=(), max_size=None, edns=False):
+    flags = FLAG_QR | FLAG_RA | (query.flags & (FLAG_OPCODE | FLAG_RD)) | rcode
+    qdcount = 1 if question else 0
+    additional = OPT_RR if edns else b""
+    response = HEADER.pack(query.id, flags, qdcount, len(answers), 0, int(edns)) + question + b"".join(answers) + additional
+    if max_size is not None and len(response) > max_size:
+        # RFC 2181, section 9: drop the whole answer section and let the client retry over TCP
+        response = HEADER.pack(query.id, flags | FLAG_TC, qdcount, 0, 0, int(edns)) + question + additional
+    return response
+
+def make_format_error(data):
+    msg_id, flags = struct.unpack_from("!HH", data)
+    flags = FLAG_QR | FLAG_RA | (flags & (FLAG_OPCODE | FLAG_RD)) | RCode.FORMERR
+    return HEADER.pack(msg_id, flags, 0, 0, 0, 0)
+
+
+class DNSServer:
+    def __init__(
+        self, address, port, lookup, concurrency=DNS_SERVER_CONCURRENCY, max_connections=DNS_SERVER_TCP_CONNECTIONS,
+    ):
+        # lookup(domain, qtype) -> ([Site], rcode, [(alias, target, ttl)])
+        self.address = address
+        self.port = port
+        self.lookup = lookup
+        # every query, UDP or TCP, is answered from the query pool; idle TCP
+        # connections only hold a slot of their own pool
+        self.pool = Pool(concurrency)
+        self.connections = Pool(max_connections)
+        self.udp_socket = None
+        self.tcp_server = None
+        self.udp_loop = None
+
+    def answer(self, data, udp):
+        if len(data) < HEADER.size:
+            return None
+        try:
+            query = parse_dns_response(data)
+        except ParseError as e:
+            logging.warning(f"Malformed query received by DNS server: {e}")
+            return make_format_error(data)
+        if query.qr:
+            return None
+        edns = next((rr for rr in query.additional if rr.type == TYPE_OPT), None)
+        if not udp:
+            max_size = MAX_TCP_SIZE
+        elif edns is not None:
+            max_size = min(max(edns.cls, CLASSIC_UDP_SIZE), EDNS_PAYLOAD_SIZE)
+        else:
+            max_size = CLASSIC_UDP_SIZE
+        if query.flags & FLAG_OPCODE:
+            return make_response(query, b"", RCode.NOTIMP, edns=edns is not None)
+        if len(query.question) != 1:
+            return make_response(query, b"", RCode.FORMERR, edns=edns is not None)
+
+        question = bytes(data[HEADER.size : parse_rr_name(data, HEADER.size)[1] + QUESTION_TAIL.size])
+        domain, qtype, qclass = query.question[0]
+        if qclass != 1 or qtype not in (QType.A.value, QType.AAAA.value):
+            return make_response(query, question, RCode.NOTIMP, edns=edns is not None)
+        qtype = QType(qtype)
+        try:
+            records, rcode, aliases = self.lookup(domain, qtype)
+        except Exception as e:
+            logging.error(f"Error occured while answering DNS query for domain {domain}: {e}")
+            records, rcode, aliases = [], RCode.SERVFAIL, []
+        answers = encode_answers(records, qtype, aliases, HEADER.size + len(question))
+        return make_response(query, question, rcode, answers, max_size, edns is not None)
+
+    def receive_batch(self):
+        # drain whatever is already queued on the socket without going back to the hub
+        batch = []
+        while len(batch) < UDP_BATCH_SIZE:
+            try:
+                batch.append(self.udp_socket.recvfrom(UDP_RECEIVE_SIZE))
+            except BlockingIOError:
+                break
+            except OSError as e:
+                logging.error(f"Error occured while receiving DNS query: {e}")
+                break
+        return batch
+
+    def serve_udp(self):
+        while True:
+            gevent.socket.wait_read(self.udp_socket.fileno())
+            for data, client in self.receive_batch():
+                self.pool.spawn(self.reply_udp, data, client)
+
+    def reply_udp(self, data, client):
+        metrics.requests_in_flight.inc("dns")
+        try:
+            response = self.answer(data, udp=True)
+        finally:
+            metrics.requests_in_flight.dec("dns")
+        if response is None:
+            return
+        try:
+            self.udp_socket.sendto(response, client)
+        except OSError as e:
+            logging.error(f"Error occured while answering DNS query from {client[0]}: {e}")
+
+    def serve_tcp(self, conn, client):
+        # queries pipelined on one connection are answered concurrently and possibly
+        # out of order (RFC 7766, section 6.2.1.1), writes are serialized by the lock;
+        # reading stops while TCP_PIPELINE_DEPTH of them are being answered
+        conn.settimeout(TCP_IDLE_TIMEOUT)
+        lock = gevent.lock.Semaphore()
+        replies = Pool(TCP_PIPELINE_DEPTH)
+        try:
+            while True:
+                prefix = receive_exactly(conn, TCP_LENGTH.size)
+                if prefix is None:
+                    break
+                data = receive_exactly(conn, TCP_LENGTH.unpack(prefix)[0])
+                if data is None:
+                    break
+                replies.spawn(self.pool.apply, self.reply_tcp, (conn, lock, data))
+        except OSError as e:
+            logging.info(f"Closing DNS connection from {client[0]}: {e}")
+        finally:
+            replies.join()
+            conn.close()
+
+    def reply_tcp(self, conn, lock, data):
+        metrics.requests_in_flight.inc("dns")
+        try:
+            response = self.answer(data, udp=False)
+        finally:
+            metrics.requests_in_flight.dec("dns")
+        if response is None:
+            return
+        with lock:
+            try:
+                conn.sendall(TCP_LENGTH.pack(len(response)) + response)
+            except OSError as e:
+                logging.error(f"Error occured while answering DNS query over TCP: {e}")
+
+    def start(self, reuse_port=False):
+        if reuse_port:
+            self.udp_socket = reuse_port_socket(self.address, self.port, socket.SOCK_DGRAM)
+            listener = reuse_port_socket(self.address, self.port)
+        else:
+            family = socket.AF_INET6 if ":" in self.address else socket.AF_INET
+            self.udp_socket = gevent.socket.socket(family, socket.SOCK_DGRAM)
+            self.udp_socket.bind((self.address, self.port))
+            listener = (self.address, self.port)
+        self.udp_socket.setblocking(False)
+        self.udp_loop = gevent.spawn(self.serve_udp)
+        self.tcp_server = StreamServer(listener, self.serve_tcp, spawn=self.connections)
+        self.tcp_server.start()
+
+    def stop(self):
+        if self.tcp_server is not None:
+            self.tcp_server.stop()
+        if self.udp_loop is not None:
+            self.udp_loop.kill()
+        if self.udp_socket is not None:
+            self.udp_socket.close()
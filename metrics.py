@@ -0,0 +1,142 @@
+import bisect
+import math
+
+
+# A minimal Prometheus text exposition (format 0.0.4), enough for a handful of
+# counters, gauges and histograms updated from greenlets of one process.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEPTH_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 12, 16)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self):
+        lines = self.header()
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def set(self, value, *label_values):
+        # mirrors a counter that is kept elsewhere, see Registry.add_collector
+        self.values[label_values] = value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) - amount
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        state = self.values.get(label_values)
+        if state is None:
+            state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += 1
+        state[2] += value
+
+    def render(self):
+        lines = self.header()
+        for label_values, (counts, count, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels + ("le",), label_values + (format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        # called right before rendering, to copy state kept elsewhere into gauges
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+cache_lookups = registry.register(Counter("dns_cache_lookups_total", "Lookups by cache status.", ("status",)))
+cache_evictions = registry.register(Counter("dns_cache_evictions_total", "Entries evicted due to the cache size."))
+negative_lookups = registry.register(
+    Counter("dns_negative_cache_lookups_total", "Negative cache lookups by result.", ("result",))
+)
+cache_entries = registry.register(Gauge("dns_cache_entries", "Cached entries by kind.", ("kind",)))
+cache_bytes = registry.register(Gauge("dns_cache_bytes", "Estimated memory used by the cache."))
+lookup_latency = registry.register(
+    Histogram("dns_lookup_duration_seconds", "Lookup latency by cache status.", ("status",))
+)
+upstream_queries = registry.register(
+    Counter("dns_upstream_queries_total", "Queries sent to nameservers by result.", ("server", "result"))
+)
+upstream_rtt = registry.register(Histogram("dns_upstream_rtt_seconds", "Round-trip time of nameserver queries."))
+upstream_srtt = registry.register(Gauge("dns_upstream_srtt_seconds", "Smoothed round-trip time per nameserver.", ("server",)))
+recursion_depth = registry.register(
+    Histogram("dns_recursion_depth", "Nameservers queried per resolution.", buckets=DEPTH_BUCKETS)
+)
+requests_in_flight = registry.register(Gauge("dns_requests_in_flight", "Requests being answered by frontend.", ("frontend",)))
+upstream_in_flight = registry.register(Gauge("dns_upstream_queries_in_flight", "Queries waiting for a nameserver."))
+resolutions_in_flight = registry.register(Gauge("dns_resolutions_in_flight", "Distinct resolutions in progress."))
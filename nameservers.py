@@ -0,0 +1,75 @@
+import time
+from constants import (
+    INITIAL_QUERY_TIMEOUT,
+    MAX_QUERY_TIMEOUT,
+    MAX_SERVER_BACKOFF,
+    MIN_QUERY_TIMEOUT,
+    MIN_RACE_STAGGER,
+    RACE_STAGGER,
+    UNKNOWN_SERVER_RTT,
+)
+
+
+class ServerStats:
+    __slots__ = ("srtt", "rttvar", "failures", "backoff_until")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.failures = 0
+        self.backoff_until = 0.0
+
+
+class NameserverSelector:
+    # smoothed RTT estimation follows RFC 6298 (alpha = 1/8, beta = 1/4)
+    def __init__(self):
+        self.stats = {}
+
+    def record_rtt(self, ip, rtt):
+        stats = self.stats.get(ip)
+        if stats is None:
+            stats = self.stats[ip] = ServerStats()
+        if stats.srtt is None:
+            stats.srtt = rtt
+            stats.rttvar = rtt / 2
+        else:
+            stats.rttvar = 0.75 * stats.rttvar + 0.25 * abs(stats.srtt - rtt)
+            stats.srtt = 0.875 * stats.srtt + 0.125 * rtt
+        stats.failures = 0
+        stats.backoff_until = 0.0
+
+    def record_failure(self, ip):
+        stats = self.stats.get(ip)
+        if stats is None:
+            stats = self.stats[ip] = ServerStats()
+        stats.failures += 1
+        backoff = min(MIN_QUERY_TIMEOUT * 2 ** stats.failures, MAX_SERVER_BACKOFF)
+        stats.backoff_until = time.monotonic() + backoff
+
+    def timeout(self, ip):
+        stats = self.stats.get(ip)
+        if stats is None or stats.srtt is None:
+            return INITIAL_QUERY_TIMEOUT
+        timeout = (stats.srtt + 4 * stats.rttvar) * 2 ** min(stats.failures, 4)
+        return min(max(timeout, MIN_QUERY_TIMEOUT), MAX_QUERY_TIMEOUT)
+
+    def stagger(self, ip):
+        stats = self.stats.get(ip)
+        if stats is None or stats.srtt is None or stats.failures:
+            return RACE_STAGGER
+        return min(max(2 * stats.srtt, MIN_RACE_STAGGER), RACE_STAGGER)
+
+    def order(self, nodes):
+        now = time.monotonic()
+
+        def score(node):
+            stats = self.stats.get(node.ip)
+            if stats is None:
+                return (False, UNKNOWN_SERVER_RTT)
+            srtt = UNKNOWN_SERVER_RTT if stats.srtt is None else stats.srtt
+            return (stats.backoff_until > now, srtt)
+
+        return sorted(nodes, key=score)
+
+
+selector = NameserverSelector()
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import socket
+import struct
+import time
+from cache import Cache, records_expiry
+from utils import Site
+
+
+# Fixed-size hash table shared by the forked workers. The table is split into
+# buckets of BUCKET_SLOTS fixed-size slots; a domain may only live in its own
+# bucket, so a full bucket evicts the entry closest to expiry.
+SLOT_HEADER = struct.Struct("=QdIBB")  # domain hash (0 marks an empty slot), expiration time, hits, name length, records
+RECORD = struct.Struct("=dIB16s")  # expiration time, original TTL, address length, address
+MAX_NAME_LENGTH = 255
+MAX_RECORDS = 8
+SLOT_SIZE = SLOT_HEADER.size + MAX_NAME_LENGTH + MAX_RECORDS * RECORD.size
+BUCKET_SLOTS = 4
+LOCK_STRIPES = 64
+
+
+def domain_key(domain):
+    key = int.from_bytes(hashlib.blake2b(domain.encode("utf-8"), digest_size=8).digest(), "little")
+    return key or 1
+
+def pack_slot(key, name, hits, records):
+    parts = [SLOT_HEADER.pack(key, records_expiry(records), min(hits, 0xFFFFFFFF), len(name), len(records)), name]
+    parts.append(b"\x00" * (MAX_NAME_LENGTH - len(name)))
+    for site, expires in records:
+        family = socket.AF_INET6 if ":" in site.ip else socket.AF_INET
+        ip = socket.inet_pton(family, site.ip)
+        parts.append(RECORD.pack(expires, site.ttl, len(ip), ip))
+    return b"".join(parts)
+
+def unpack_slot(data):
+    key, _, hits, name_length, count = SLOT_HEADER.unpack_from(data)
+    domain = data[SLOT_HEADER.size : SLOT_HEADER.size + name_length].decode("utf-8")
+    records = []
+    offset = SLOT_HEADER.size + MAX_NAME_LENGTH
+    for _ in range(count):
+        expires, ttl, ip_length, ip = RECORD.unpack_from(data, offset)
+        family = socket.AF_INET6 if ip_length == 16 else socket.AF_INET
+        records.append((Site(domain, socket.inet_ntop(family, ip[:ip_length]), ttl), expires))
+        offset += RECORD.size
+    return domain, hits, records
+
+
+class SharedTable:
+    def __init__(self, size):
+        # an anonymous mapping is MAP_SHARED, so it has to be created before the workers are forked
+        self.buckets = max((size + BUCKET_SLOTS - 1) // BUCKET_SLOTS, 1)
+        self.map = mmap.mmap(-1, self.buckets * BUCKET_SLOTS * SLOT_SIZE)
+        self.locks = [multiprocessing.Lock() for _ in range(LOCK_STRIPES)]
+        self.evictions = multiprocessing.Value("Q", 0, lock=False)
+
+    def locate(self, key):
+        bucket = key % self.buckets
+        return bucket * BUCKET_SLOTS * SLOT_SIZE, self.locks[bucket % LOCK_STRIPES]
+
+    def find(self, start, key, name):
+        for offset in range(start, start + BUCKET_SLOTS * SLOT_SIZE, SLOT_SIZE):
+            slot_key, _, _, name_length, _ = SLOT_HEADER.unpack_from(self.map, offset)
+            name_start = offset + SLOT_HEADER.size
+            if slot_key == key and self.map[name_start : name_start + name_length] == name:
+                return offset
+        return None
+
+    def get(self, domain):
+        key = domain_key(domain)
+        name = domain.encode("utf-8")
+        start, lock = self.locate(key)
+        with lock:
+            offset = self.find(start, key, name)
+            if offset is None:
+                return None
+            _, expires, hits, name_length, count = SLOT_HEADER.unpack_from(self.map, offset)
+            SLOT_HEADER.pack_into(self.map, offset, key, expires, min(hits + 1, 0xFFFFFFFF), name_length, count)
+            data = self.map[offset : offset + SLOT_SIZE]
+        _, hits, records = unpack_slot(data)
+        return hits, records
+
+    def put(self, domain, records, hits):
+        name = domain.encode("utf-8")
+        if not records or len(name) > MAX_NAME_LENGTH:
+            return
+        key = domain_key(domain)
+        start, lock = self.locate(key)
+        if len(records) > MAX_RECORDS:
+            # a cut RRset would be served as the whole answer, so such domains stay
+            # in the per-process caches; an older copy is dropped from the table
+            with lock:
+                offset = self.find(start, key, name)
+                if offset is not None:
+                    self.map[offset : offset + SLOT_HEADER.size] = bytes(SLOT_HEADER.size)
+            return
+        data = pack_slot(key, name, hits, records)
+        with lock:
+            offset = self.find(start, key, name)
+            if offset is None:
+                offset = self.victim(start)
+            self.map[offset : offset + len(data)] = data
+
+    def victim(self, start):
+        # an empty slot if there is one, otherwise the entry that expires first
+        victim, victim_expires = None, None
+        for offset in range(start, start + BUCKET_SLOTS * SLOT_SIZE, SLOT_SIZE):
+            slot_key, expires, _, _, _ = SLOT_HEADER.unpack_from(self.map, offset)
+            if slot_key == 0:
+                return offset
+            if victim is None or expires < victim_expires:
+                victim, victim_expires = offset, expires
+        self.evictions.value += 1
+        logging.info("Evicting an entry from the shared cache due to its size...")
+        return victim
+
+    def items(self):
+        for bucket in range(self.buckets):
+            start = bucket * BUCKET_SLOTS * SLOT_SIZE
+            with self.locks[bucket % LOCK_STRIPES]:
+                data = self.map[start : start + BUCKET_SLOTS * SLOT_SIZE]
+            for offset in range(0, len(data), SLOT_SIZE):
+                if SLOT_HEADER.unpack_from(data, offset)[0]:
+                    yield unpack_slot(data[offset : offset + SLOT_SIZE])
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+
+class SharedCache(Cache):
+    # the per-process Cache stays in front of the shared table: a miss or an expired
+    # entry is looked up in the table, which other workers may have filled already
+    def __init__(self, table, **kwargs):
+        super().__init__(**kwargs)
+        self.table = table
+
+    def add(self, domain, timestamp, sites):
+        super().add(domain, timestamp, sites)
+        entry = self.cache.get(domain)
+        if entry is not None:
+            self.table.put(domain, entry.sites(domain), entry.hits)
+
+    def load(self, domain):
+        if self.max_size == 0:
+            return None
+        found = self.table.get(domain)
+        if found is None:
+            return super().load(domain)
+        hits, records = found
+        if records_expiry(records) + self.max_stale < time.time():
+            return None
+        self.store(domain, records, hits)
+        return self.cache[domain]
+
+    def get(self, domain):
+        entry = self.cache.get(domain)
+        if entry is not None and entry.expires < time.time():
+            found = self.table.get(domain)
+            if found is not None and records_expiry(found[1]) > entry.expires:
+                logging.info(f"Using cache info for domain {domain} refreshed by another worker...")
+                self.store(domain, found[1], entry.hits)
+        return super().get(domain)
+
+    def snapshot_items(self):
+        seen = set()
+        for domain, hits, records in self.table.items():
+            seen.add(domain)
+            yield domain, hits, records
+        for domain, hits, records in super().snapshot_items():
+            if domain not in seen:
+                yield domain, hits, records
@@ -0,0 +1,246 @@
+import gevent
+import gevent.lock
+import hashlib
+import logging
+import mmap
+import os
+import socket
+import struct
+import time
+from cache import records_expiry
+from utils import Site
+
+
+# File layout: header, cache entries, delegation section, hash index.
+# Every expiration time is absolute (seconds since the epoch), so a snapshot
+# stays valid across restarts and expired records are simply skipped.
+MAGIC = b"DNSCACHE"
+VERSION = 1
+FILE_HEADER = struct.Struct("!8sHQQQQ")  # magic, version, entries, index slots, index offset, delegations offset
+INDEX_SLOT = struct.Struct("!QQ")  # domain hash, entry offset (0 marks an empty slot)
+ENTRY_HEADER = struct.Struct("!IH")  # hits, number of records
+RECORD = struct.Struct("!dIB")  # expiration time, original TTL, address length
+ZONE = struct.Struct("!dH")  # expiration time, number of nameservers
+GLUE = struct.Struct("!dB")  # expiration time, address length
+COUNT = struct.Struct("!I")
+NAME_LENGTH = struct.Struct("!H")
+WRITE_BATCH = 4096  # entries written between yields to the other greenlets
+# what a corrupt body raises while being decoded (bad lengths, addresses, names or expiration times)
+DECODE_ERRORS = (struct.error, UnicodeDecodeError, ValueError, OverflowError)
+
+write_lock = gevent.lock.Semaphore()  # the periodic save may still be running on shutdown
+
+
+def domain_hash(domain):
+    return int.from_bytes(hashlib.blake2b(domain.encode("utf-8"), digest_size=8).digest(), "big")
+
+def pack_name(name):
+    name = name.encode("utf-8")
+    return NAME_LENGTH.pack(len(name)) + name
+
+def pack_ip(ip):
+    return socket.inet_pton(socket.AF_INET6 if ":" in ip else socket.AF_INET, ip)
+
+def unpack_ip(packed):
+    return socket.inet_ntop(socket.AF_INET6 if len(packed) == 16 else socket.AF_INET, packed)
+
+def pack_entry(domain, hits, records):
+    parts = [pack_name(domain), ENTRY_HEADER.pack(min(hits, 0xFFFFFFFF), len(records))]
+    for site, expires in records:
+        ip = pack_ip(site.ip)
+        parts += [RECORD.pack(expires, site.ttl, len(ip)), ip, pack_name(site.url)]
+    return b"".join(parts)
+
+
+class SnapshotReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.entries, self.slots, self.index, self.delegations = FILE_HEADER.unpack_from(self.map)
+        except struct.error:
+            self.map.close()
+            raise ValueError(f"{path} is too short to be a cache snapshot")
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError(f"{path} is not a cache snapshot of version {VERSION}")
+        if not FILE_HEADER.size <= self.delegations <= self.index <= len(self.map) - self.slots * INDEX_SLOT.size:
+            self.map.close()
+            raise ValueError(f"{path} is a truncated or corrupt cache snapshot")
+
+    def read_name(self, offset):
+        (length,) = NAME_LENGTH.unpack_from(self.map, offset)
+        offset += NAME_LENGTH.size
+        return self.map[offset : offset + length].decode("utf-8"), offset + length
+
+    def read_entry(self, offset):
+        domain, offset = self.read_name(offset)
+        hits, count = ENTRY_HEADER.unpack_from(self.map, offset)
+        offset += ENTRY_HEADER.size
+        records = []
+        for _ in range(count):
+            expires, ttl, ip_length = RECORD.unpack_from(self.map, offset)
+            offset += RECORD.size
+            ip = unpack_ip(self.map[offset : offset + ip_length])
+            url, offset = self.read_name(offset + ip_length)
+            records.append((Site(url, ip, ttl), expires))
+        return domain, hits, records, offset
+
+    def find(self, domain):
+        # open addressing with linear probing, only the probed slots and one entry are decoded
+        if not self.slots:
+            return None
+        key = domain_hash(domain)
+        slot = key % self.slots
+        for _ in range(self.slots):
+            slot_key, offset = INDEX_SLOT.unpack_from(self.map, self.index + slot * INDEX_SLOT.size)
+            if offset == 0:
+                return None
+            if slot_key == key:
+                try:
+                    name, hits, records, _ = self.read_entry(offset)
+                except DECODE_ERRORS as e:
+                    logging.error(f"Skipping corrupt entry for domain {domain} in cache snapshot {self.path}: {e}")
+                    return None
+                if name == domain:
+                    return hits, records
+            slot = (slot + 1) % self.slots
+        return None
+
+    def items(self):
+        # entries are read one after another, nothing past a corrupt one can be trusted
+        offset = FILE_HEADER.size
+        for _ in range(self.entries):
+            try:
+                domain, hits, records, offset = self.read_entry(offset)
+            except DECODE_ERRORS as e:
+                logging.error(f"Stopping at corrupt entry at offset {offset} of cache snapshot {self.path}: {e}")
+                return
+            yield domain, hits, records
+
+    def read_delegations(self):
+        offset = self.delegations
+        zones = []
+        (count,) = COUNT.unpack_from(self.map, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            zone, offset = self.read_name(offset)
+            expires, ns_count = ZONE.unpack_from(self.map, offset)
+            offset += ZONE.size
+            ns_names = []
+            for _ in range(ns_count):
+                ns_name, offset = self.read_name(offset)
+                ns_names.append(ns_name)
+            zones.append((zone, expires, ns_names))
+        glue = []
+        (count,) = COUNT.unpack_from(self.map, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            ns_name, offset = self.read_name(offset)
+            expires, ip_length = GLUE.unpack_from(self.map, offset)
+            offset += GLUE.size
+            glue.append((ns_name, unpack_ip(self.map[offset : offset + ip_length]), expires))
+            offset += ip_length
+        return zones, glue
+
+    def close(self):
+        self.map.close()
+
+    def __len__(self):
+        return self.entries
+
+
+def pack_delegations(delegations, now):
+    zones = [(zone, entry) for zone, entry in delegations.zones.items() if entry["TIME"] >= now]
+    parts = [COUNT.pack(len(zones))]
+    for zone, entry in zones:
+        parts += [pack_name(zone), ZONE.pack(entry["TIME"], len(entry["NS"]))]
+        parts += [pack_name(ns_name) for ns_name in entry["NS"]]
+    glue = [
+        (ns_name, ip, expires)
+        for ns_name, addresses in delegations.glue.items()
+        for ip, expires in addresses.items()
+        if expires >= now
+    ]
+    parts.append(COUNT.pack(len(glue)))
+    for ns_name, ip, expires in glue:
+        packed = pack_ip(ip)
+        parts += [pack_name(ns_name), GLUE.pack(expires, len(packed)), packed]
+    return b"".join(parts)
+
+def write_snapshot(path, cache, delegations):
+    with write_lock:
+        return write_snapshot_file(path, cache, delegations)
+
+def write_snapshot_file(path, cache, delegations):
+    # entries still waiting in the previous snapshot are carried over, so the file
+    # is written in full to a temporary path and atomically moved into place
+    start = time.time()
+    now = start - cache.max_stale
+    tmp_path = path + ".tmp"
+    hashes = []
+    with open(tmp_path, "wb") as f:
+        f.write(b"\x00" * FILE_HEADER.size)
+        offset = FILE_HEADER.size
+        for i, (domain, hits, records) in enumerate(cache.snapshot_items(), 1):
+            if i % WRITE_BATCH == 0:
+                gevent.idle()  # sleep(0) would not let pending IO and timers run
+            if records_expiry(records) < now:
+                continue
+            data = pack_entry(domain, hits, records)
+            hashes.append((domain_hash(domain), offset))
+            f.write(data)
+            offset += len(data)
+
+        delegations_offset = offset
+        data = pack_delegations(delegations, start)
+        f.write(data)
+        offset += len(data)
+
+        slots = 2 * len(hashes)
+        keys = [0] * slots
+        offsets = [0] * slots
+        for i, (key, entry_offset) in enumerate(hashes, 1):
+            if i % WRITE_BATCH == 0:
+                gevent.idle()
+            slot = key % slots
+            while offsets[slot]:
+                slot = (slot + 1) % slots
+            keys[slot] = key
+            offsets[slot] = entry_offset
+        for i in range(0, slots, WRITE_BATCH):
+            f.write(b"".join(map(INDEX_SLOT.pack, keys[i:i + WRITE_BATCH], offsets[i:i + WRITE_BATCH])))
+            gevent.idle()
+        f.seek(0)
+        f.write(FILE_HEADER.pack(MAGIC, VERSION, len(hashes), slots, offset, delegations_offset))
+        # the data has to reach the disk before the rename, or a crash may leave a
+        # truncated file under the real name
+        f.flush()
+        os.fsync(f.fileno())
+
+    cache.detach_snapshot()
+    os.replace(tmp_path, path)
+    # domains carried over from the previous snapshot stay available for lazy loading
+    cache.attach_snapshot(SnapshotReader(path))
+    logging.info(f"Saved {len(hashes)} cached domains to {path} in {time.time() - start:.2f} seconds")
+    return len(hashes)
+
+def load_snapshot(path, cache, delegations):
+    try:
+        reader = SnapshotReader(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"Error occured while loading cache snapshot {path}: {e}")
+        return None
+    try:
+        zones, glue = reader.read_delegations()
+    except DECODE_ERRORS as e:
+        logging.error(f"Error occured while loading cache snapshot {path}, ignoring it: {e}")
+        reader.close()
+        return None
+    delegations.restore(zones, glue)
+    cache.attach_snapshot(reader)
+    logging.info(f"Attached cache snapshot {path} with {len(reader)} domains")
+    return reader
@@ -0,0 +1,120 @@
+import time
+from benchmarks.parser import encode_response
+from cache import Cache
+from dns_parser import is_nodata, negative_ttl, parse_dns_response
+from shared_cache import MAX_RECORDS, SharedTable
+from utils import QType, RCode, Site
+
+
+def test_entry_expires_with_its_first_rrset():
+    cache = Cache()
+    now = time.time()
+    cache.add("x.com", now - 10, [Site("x.com", "192.0.2.1", 5), Site("x.com", "::1", 3600)])
+    # the A RRset has expired: a hit with only the AAAA record would be a false NODATA for A
+    assert cache.get("x.com") is None
+
+def test_entry_is_a_hit_while_every_rrset_is_alive():
+    cache = Cache()
+    cache.add("x.com", time.time(), [Site("x.com", "192.0.2.1", 5), Site("x.com", "::1", 3600)])
+    assert sorted(site.ip for site in cache.get("x.com")) == ["192.0.2.1", "::1"]
+
+def test_shared_table_skips_rrsets_that_do_not_fit():
+    table = SharedTable(16)
+    expires = time.time() + 300
+    table.put("x.com", [(Site("x.com", "192.0.2.1", 300), expires)], 1)
+    records = [(Site("x.com", f"192.0.2.{i}", 300), expires) for i in range(MAX_RECORDS + 1)]
+    table.put("x.com", records, 1)
+    # neither a cut RRset nor the outdated one is served
+    assert table.get("x.com") is None
+
+def test_memory_budget_evicts_the_least_recently_used_kind():
+    cache = Cache(max_bytes=100_000)
+    now = time.time()
+    for i in range(1000):
+        cache.add_negative(f"missing{i}.com", QType.A, RCode.NXDOMAIN, 60, now)
+    for i in range(20):
+        cache.add(f"x{i}.com", now, [Site(f"x{i}.com", "192.0.2.1", 300)])
+    # the older negative answers make room, not the positive entries just added
+    assert len(cache) == 20
+    assert cache.bytes + cache.negative_bytes <= cache.max_bytes
+    assert cache.get_negative("missing0.com", QType.A) is None
+    assert cache.get_negative("missing999.com", QType.A) is not None
+
+def test_nxdomain_covers_every_type():
+    cache = Cache()
+    cache.add_negative("missing.com", QType.A, RCode.NXDOMAIN, 60, time.time())
+    negative = cache.get_negative("missing.com", QType.AAAA)
+    assert negative.rcode == RCode.NXDOMAIN and 58 <= negative.ttl <= 60
+
+def test_nodata_covers_its_own_type():
+    cache = Cache()
+    cache.add_negative("x.com", QType.AAAA, RCode.NOERROR, 60, time.time())
+    assert cache.get_negative("x.com", QType.AAAA).rcode == RCode.NOERROR
+    assert cache.get_negative("x.com", QType.A) is None
+    assert (cache.negative_hits, cache.negative_misses) == (1, 1)
+
+def test_negative_entries_expire():
+    cache = Cache()
+    cache.add_negative("missing.com", QType.A, RCode.NXDOMAIN, 60, time.time() - 61)
+    assert cache.get_negative("missing.com", QType.A) is None
+    assert len(cache.negative) == 0
+
+def test_negative_cache_limits():
+    cache = Cache(max_negative_size=2)
+    now = time.time()
+    cache.add_negative("zero.com", QType.A, RCode.NXDOMAIN, 0, now)  # an SOA minimum of 0 means do not cache
+    for name in ("a.com", "b.com", "c.com"):
+        cache.add_negative(name, QType.A, RCode.NXDOMAIN, 60, now)
+    assert [domain for domain, _ in cache.negative] == ["b.com", "c.com"]
+    disabled = Cache(max_negative_size=0)
+    disabled.add_negative("a.com", QType.A, RCode.NXDOMAIN, 60, now)
+    assert disabled.get_negative("a.com", QType.A) is None
+
+def negative_response(rcode, soa_ttl=300, minimum=60, authority=True, flags=0x8400):
+    soa = ("x.com", QType.SOA, soa_ttl, ("ns1.x.com", "hostmaster.x.com", 1, 3600, 600, 86400, minimum))
+    return parse_dns_response(encode_response("www.x.com", QType.A, authority=[soa] if authority else [], flags=flags | rcode))
+
+def test_negative_ttl_is_the_lesser_of_soa_ttl_and_minimum():
+    assert negative_ttl(negative_response(RCode.NXDOMAIN, soa_ttl=300, minimum=60)) == 60
+    assert negative_ttl(negative_response(RCode.NXDOMAIN, soa_ttl=30, minimum=60)) == 30
+    assert negative_ttl(negative_response(RCode.NXDOMAIN, authority=False)) == 0
+
+def test_nodata_detection():
+    assert is_nodata(negative_response(RCode.NOERROR))
+    assert is_nodata(negative_response(RCode.NOERROR, authority=False))  # authoritative, without a referral
+    assert not is_nodata(negative_response(RCode.NOERROR, authority=False, flags=0x8000))
+    assert not is_nodata(negative_response(RCode.NXDOMAIN))
+    referral = encode_response("www.x.com", QType.A, authority=[("x.com", QType.NS, 300, "ns1.x.com")])
+    assert not is_nodata(parse_dns_response(referral))
+
+def test_stale_entries_are_served_within_max_stale():
+    cache = Cache(max_stale=3600, stale_ttl=30)
+    cache.add("x.com", time.time() - 400, [Site("x.com", "192.0.2.1", 300)])
+    assert cache.get("x.com") is None
+    assert [(site.ip, site.ttl) for site in cache.get_stale("x.com")] == [("192.0.2.1", 30)]
+    cache.update()
+    assert "x.com" in cache.cache
+
+def test_entries_past_max_stale_are_dropped():
+    cache = Cache(max_stale=60)
+    cache.add("x.com", time.time() - 400, [Site("x.com", "192.0.2.1", 300)])
+    assert cache.get_stale("x.com") is None
+    cache.update()
+    assert len(cache) == 0
+    assert Cache().get_stale("x.com") is None
+
+def test_prefetch_candidates():
+    cache = Cache()
+    now = time.time()
+    cache.add("popular.com", now, [Site("popular.com", "192.0.2.1", 5)])
+    cache.add("rare.com", now, [Site("rare.com", "192.0.2.2", 5)])
+    cache.add("later.com", now, [Site("later.com", "192.0.2.3", 300)])
+    cache.add("expired.com", now - 10, [Site("expired.com", "192.0.2.4", 5)])
+    for _ in range(3):
+        for domain in ("popular.com", "later.com", "expired.com"):
+            cache.get(domain)
+    cache.get("rare.com")
+    assert cache.prefetch_candidates(10, 3) == ["popular.com"]
+    # a refreshed entry leaves its old place in the expiry heap behind
+    cache.add("popular.com", now, [Site("popular.com", "192.0.2.1", 300)])
+    assert cache.prefetch_candidates(10, 1) == ["rare.com"]
@@ -0,0 +1,69 @@
+import coalesce
+import dns_parser
+import gevent
+import pytest
+from cache import DelegationCache
+from constants import MAX_STEPS
+from utils import RR, Message, QType, Site
+
+
+ROOT = Site("a.root-servers.net", "198.41.0.4")
+
+
+def glueless_referrals(monkeypatch, delegations):
+    # the root refers every zone to nameservers it has no glue for
+    def query_servers(domain, qtype, nodes, dns_port):
+        zone = ".".join(domain.lower().split(".")[-2:])
+        authority = [RR(zone, QType.NS.value, 1, 3600, delegations[zone])]
+        return ROOT, Message(0, 0x8000, [], [], authority, [])
+    monkeypatch.setattr(dns_parser, "query_servers", query_servers)
+
+def resolve(domain):
+    with gevent.Timeout(5):
+        return dns_parser.resolve_step(domain, [ROOT], [ROOT], [], 0, QType.A, 53, MAX_STEPS, DelegationCache())
+
+
+def test_circular_glueless_delegation(monkeypatch):
+    glueless_referrals(monkeypatch, {"a.com": "ns.b.com", "b.com": "ns.a.com"})
+    assert resolve("www.a.com") is None
+    assert len(coalesce.flights) == 0
+
+def test_in_zone_nameserver_without_glue(monkeypatch):
+    glueless_referrals(monkeypatch, {"a.com": "ns.a.com"})
+    assert resolve("www.a.com") is None
+    assert len(coalesce.flights) == 0
+
+def test_identical_lookups_share_one_call():
+    flights = coalesce.SingleFlight()
+    calls = []
+
+    def lookup(domain):
+        calls.append(domain)
+        gevent.sleep(0.01)
+        return domain.upper()
+    greenlets = [gevent.spawn(flights.do, "x.com", lookup, "x.com") for _ in range(5)]
+    gevent.joinall(greenlets)
+    assert [greenlet.value for greenlet in greenlets] == ["X.COM"] * 5
+    assert calls == ["x.com"]
+    assert len(flights) == 0
+
+def test_waiters_give_up_on_a_stuck_flight():
+    flights = coalesce.SingleFlight(timeout=0.05)
+    stuck = gevent.spawn(flights.do, "x.com", gevent.sleep, 10)
+    gevent.sleep(0)
+    with gevent.Timeout(1):
+        assert flights.do("x.com", str.upper, "x.com") == "X.COM"
+    stuck.kill()
+    assert len(flights) == 0
+
+def test_failures_reach_the_waiters():
+    flights = coalesce.SingleFlight()
+
+    def fail():
+        gevent.sleep(0.01)
+        raise ValueError("upstream failure")
+    greenlets = [gevent.spawn(flights.do, "x.com", fail) for _ in range(3)]
+    gevent.joinall(greenlets)
+    assert all(isinstance(greenlet.exception, ValueError) for greenlet in greenlets)
+    with pytest.raises(ValueError):
+        flights.do("x.com", fail)
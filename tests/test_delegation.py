@@ -0,0 +1,68 @@
+import dns_parser
+from cache import DelegationCache
+from constants import MAX_STEPS
+from utils import RR, Message, QType, Site
+
+
+# Referrals are checked against the zone of the servers that sent them.
+EXAMPLE_SERVER = Site("ns1.example.com", "192.0.2.1")
+
+
+def referral(zone, ns_name, glue_ip):
+    authority = [RR(zone, QType.NS.value, 1, 3600, ns_name)]
+    additional = [RR(ns_name, QType.A.value, 1, 3600, glue_ip)]
+    return Message(0, 0x8000, [], [], authority, additional)
+
+def resolve_with_reply(monkeypatch, domain, zone, reply):
+    monkeypatch.setattr(dns_parser, "query_servers", lambda *args: (EXAMPLE_SERVER, reply))
+    delegations = DelegationCache()
+    root = [Site("a.root-servers.net", "198.41.0.4")]
+    result = dns_parser.resolve_step(
+        domain, [EXAMPLE_SERVER], root, [], MAX_STEPS, QType.A, 53, MAX_STEPS, delegations, zone
+    )
+    return result, delegations
+
+
+def test_referral_above_the_sender_is_ignored(monkeypatch):
+    reply = referral("com", "a.gtld-servers.net", "6.6.6.6")
+    result, delegations = resolve_with_reply(monkeypatch, "www.example.com", "example.com", reply)
+    assert result is None
+    assert delegations.closest("anything.com", QType.A) == (None, [])
+    assert delegations.glue == {}
+
+def test_referral_to_the_sender_zone_is_ignored(monkeypatch):
+    reply = referral("example.com", "ns2.example.com", "6.6.6.6")
+    _, delegations = resolve_with_reply(monkeypatch, "www.example.com", "example.com", reply)
+    assert delegations.zones == {}
+
+def test_glue_outside_the_sender_zone_is_ignored(monkeypatch):
+    reply = referral("sub.example.com", "ns.evil.net", "6.6.6.6")
+    _, delegations = resolve_with_reply(monkeypatch, "www.sub.example.com", "example.com", reply)
+    assert "sub.example.com" in delegations.zones
+    assert delegations.glue == {}
+
+def test_referral_below_the_sender_is_cached(monkeypatch):
+    reply = referral("sub.example.com", "ns.sub.example.com", "192.0.2.53")
+    _, delegations = resolve_with_reply(monkeypatch, "www.sub.example.com", "example.com", reply)
+    zone, nodes = delegations.closest("other.sub.example.com", QType.A)
+    assert zone == "sub.example.com"
+    assert [node.ip for node in nodes] == ["192.0.2.53"]
+
+def test_referral_zone():
+    ns_rrs = [RR("example.com", QType.NS.value, 1, 3600, "ns1.example.com")]
+    assert dns_parser.referral_zone("www.example.com", ns_rrs, "com") == "example.com"
+    assert dns_parser.referral_zone("www.example.com", ns_rrs, "") == "example.com"
+    assert dns_parser.referral_zone("www.example.org", ns_rrs, "") is None
+    assert dns_parser.referral_zone("www.example.com", ns_rrs, "example.com") is None
+    assert dns_parser.referral_zone("www.example.com", ns_rrs, "org") is None
+
+def test_aliases_outside_the_sender_zone_are_not_followed():
+    answer = [
+        RR("www.example.com", QType.CNAME.value, 1, 300, "cdn.example.com"),
+        RR("cdn.example.com", QType.CNAME.value, 1, 300, "www.google.com"),
+        RR("www.google.com", QType.CNAME.value, 1, 300, "evil.example.net"),
+        RR("google.com", QType.DNAME.value, 1, 300, "example.net"),
+    ]
+    links = dns_parser.follow_aliases("www.example.com", answer, "example.com")
+    assert links == [("www.example.com", "cdn.example.com", 300), ("cdn.example.com", "www.google.com", 300)]
+    assert len(dns_parser.follow_aliases("mail.google.com", answer, "example.com")) == 0
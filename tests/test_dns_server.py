@@ -0,0 +1,108 @@
+import gevent
+import gevent.socket
+import pytest
+import socket
+from constants import TCP_PIPELINE_DEPTH
+from dns_parser import parse_dns_response
+from dns_server import DNSServer
+from transport import TCP_LENGTH, receive_exactly
+from utils import QType, RCode, Site, make_dns_query
+
+
+ADDRESS = "127.0.0.1"
+PORT = 5398
+
+
+class Lookups:
+    def __init__(self, records=1, delay=0.0):
+        self.records = records
+        self.delay = delay
+        self.running = 0
+        self.most_running = 0
+
+    def __call__(self, domain, qtype):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        try:
+            gevent.sleep(self.delay)
+            return [Site(domain, f"192.0.2.{i + 1}", 60) for i in range(self.records)], RCode.NOERROR, []
+        finally:
+            self.running -= 1
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(lookup, **kwargs):
+        server = DNSServer(ADDRESS, PORT, lookup, **kwargs)
+        server.start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+
+def udp_query(message, timeout=2):
+    sock = gevent.socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.settimeout(timeout)
+        sock.sendto(message, (ADDRESS, PORT))
+        return parse_dns_response(sock.recv(65535))
+    finally:
+        sock.close()
+
+def tcp_connect():
+    return gevent.socket.create_connection((ADDRESS, PORT), timeout=2)
+
+def tcp_receive(conn):
+    return parse_dns_response(receive_exactly(conn, TCP_LENGTH.unpack(receive_exactly(conn, TCP_LENGTH.size))[0]))
+
+
+def test_udp_answer(serve):
+    serve(Lookups())
+    query = make_dns_query("x.com", QType.A)
+    response = udp_query(query)
+    assert response.id == int.from_bytes(query[:2], "big")
+    assert response.question == [("x.com", QType.A.value, 1)]
+    assert [(rr.name, rr.rdata) for rr in response.answer] == [("x.com", "192.0.2.1")]
+
+def test_large_udp_answer_is_truncated_and_complete_over_tcp(serve):
+    serve(Lookups(records=40))
+    query = make_dns_query("x.com", QType.A)
+    assert udp_query(query).tc and udp_query(query).answer == []
+    with tcp_connect() as conn:
+        conn.sendall(TCP_LENGTH.pack(len(query)) + query)
+        response = tcp_receive(conn)
+    assert not response.tc and len(response.answer) == 40
+
+def test_pipelined_tcp_queries(serve):
+    lookups = Lookups(delay=0.01)
+    serve(lookups)
+    queries = [make_dns_query(f"x{i}.com", QType.A) for i in range(3 * TCP_PIPELINE_DEPTH)]
+    with tcp_connect() as conn:
+        conn.sendall(b"".join(TCP_LENGTH.pack(len(query)) + query for query in queries))
+        responses = [tcp_receive(conn) for _ in queries]
+    assert sorted(response.question[0][0] for response in responses) == sorted(f"x{i}.com" for i in range(len(queries)))
+    assert all(response.answer[0].name == response.question[0][0] for response in responses)
+    assert 1 < lookups.most_running <= TCP_PIPELINE_DEPTH
+
+def test_idle_tcp_connections_do_not_block_udp(serve):
+    serve(Lookups(), concurrency=2, max_connections=2)
+    connections = [tcp_connect() for _ in range(4)]
+    try:
+        gevent.sleep(0.05)
+        assert udp_query(make_dns_query("x.com", QType.A), timeout=1).rcode == RCode.NOERROR
+    finally:
+        for conn in connections:
+            conn.close()
+
+def test_tcp_queries_share_the_query_pool(serve):
+    lookups = Lookups(delay=0.01)
+    serve(lookups, concurrency=4)
+    query = make_dns_query("x.com", QType.A)
+    with tcp_connect() as conn:
+        conn.sendall((TCP_LENGTH.pack(len(query)) + query) * 20)
+        for _ in range(20):
+            tcp_receive(conn)
+    assert lookups.most_running == 4
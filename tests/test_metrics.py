@@ -0,0 +1,75 @@
+import dns_resolver
+import logging
+import time
+from cache import Cache
+from metrics import Counter, Gauge, Histogram, Registry
+from tracing import Tracer
+from utils import QType, RCode, Site
+
+
+def test_counter_and_gauge():
+    lookups = Counter("lookups_total", "Lookups by status.", ("status",))
+    lookups.inc("miss")
+    lookups.inc("hit", amount=2)
+    in_flight = Gauge("in_flight", "Requests in flight.")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    assert lookups.render() == [
+        "# HELP lookups_total Lookups by status.",
+        "# TYPE lookups_total counter",
+        'lookups_total{status="hit"} 2',
+        'lookups_total{status="miss"} 1',
+    ]
+    assert in_flight.render()[-1] == "in_flight 1"
+
+def test_label_values_are_escaped():
+    queries = Counter("queries_total", "Queries.", ("server",))
+    queries.inc('a"b\\c\nd')
+    assert queries.render()[-1] == 'queries_total{server="a\\"b\\\\c\\nd"} 1'
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram("latency_seconds", "Latency.", ("status",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, "hit")
+    assert latency.render()[2:] == [
+        'latency_seconds_bucket{status="hit",le="0.1"} 2',
+        'latency_seconds_bucket{status="hit",le="1.0"} 3',
+        'latency_seconds_bucket{status="hit",le="+Inf"} 4',
+        'latency_seconds_sum{status="hit"} 3.65',
+        'latency_seconds_count{status="hit"} 4',
+    ]
+
+def test_collectors_run_before_rendering():
+    registry = Registry()
+    entries = registry.register(Gauge("entries", "Entries."))
+    cache = {"x.com": 1}
+    registry.add_collector(lambda: entries.set(len(cache)))
+    cache["y.com"] = 2
+    assert registry.render() == "# HELP entries Entries.\n# TYPE entries gauge\nentries 2\n"
+
+def test_metrics_endpoint(monkeypatch):
+    cache = Cache()
+    now = time.time()
+    cache.add("x.com", now, [Site("x.com", "192.0.2.1", 300)])
+    cache.add_negative("missing.com", QType.A, RCode.NXDOMAIN, 60, now)
+    cache.get_negative("missing.com", QType.A)
+    monkeypatch.setitem(dns_resolver.app.config, "cache", cache)
+    response = dns_resolver.app.test_client().get("/metrics")
+    assert response.status_code == 200 and response.mimetype == "text/plain"
+    lines = response.get_data(as_text=True).splitlines()
+    assert 'dns_cache_entries{kind="positive"} 1' in lines
+    assert 'dns_cache_entries{kind="negative"} 1' in lines
+    assert 'dns_negative_cache_lookups_total{result="hit"} 1' in lines
+    assert "# TYPE dns_lookup_duration_seconds histogram" in lines
+
+def test_only_sampled_traces_are_logged(caplog):
+    caplog.set_level(logging.INFO)
+    assert not Tracer(0.0).start().sampled
+    trace = Tracer(1.0).start()
+    assert trace.sampled and Tracer(0.0).child(trace).sampled
+    Tracer().step("x.com", Tracer(0.0).start())
+    assert caplog.records == []
+    trace.append(Site("a.root-servers.net", "198.41.0.4"))
+    Tracer().step("x.com", trace)
+    assert "a.root-servers.net" in caplog.text
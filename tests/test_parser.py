@@ -0,0 +1,67 @@
+import pytest
+import struct
+from dns_parser import HEADER, RR_HEADER, ParseError, parse_dns_response, parse_rr_name
+
+
+# Crafted messages for the name decompression and bounds checks of the binary parser.
+def header(ancount=0, qdcount=0):
+    return HEADER.pack(0x1234, 0x8400, qdcount, ancount, 0, 0)
+
+
+def test_plain_name():
+    message = header() + b"\x03www\x07example\x03com\x00"
+    assert parse_rr_name(message, 12) == ("www.example.com", len(message))
+
+def test_pointer_chain():
+    message = header() + b"\x03com\x00"  # offset 12
+    message += b"\x07example\xc0\x0c"  # offset 17
+    message += b"\x03www\xc0\x11"  # offset 27
+    assert parse_rr_name(message, 17) == ("example.com", 27)
+    # the end offset is right after the first pointer, not after the name it points to
+    assert parse_rr_name(message, 27) == ("www.example.com", 33)
+
+def test_self_pointing_pointer():
+    message = header() + b"\xc0\x0c"
+    with pytest.raises(ParseError):
+        parse_rr_name(message, 12)
+
+def test_forward_pointer():
+    message = header() + b"\x03www\xc0\x14" + b"\x03com\x00"
+    with pytest.raises(ParseError):
+        parse_rr_name(message, 12)
+
+def test_pointer_loop_through_labels():
+    # a label whose pointer leads back to the label itself
+    message = header() + b"\x03www\xc0\x0c"
+    with pytest.raises(ParseError):
+        parse_rr_name(message, 16)
+
+def test_name_out_of_bounds():
+    with pytest.raises(ParseError):
+        parse_rr_name(header() + b"\x05ab", 12)
+    with pytest.raises(ParseError):
+        parse_rr_name(header() + b"\x03www\xc0", 12)
+
+def test_unsupported_label_type():
+    with pytest.raises(ParseError):
+        parse_rr_name(header() + b"\x40abc\x00", 12)
+
+def test_truncated_header():
+    with pytest.raises(ParseError):
+        parse_dns_response(header()[:5])
+
+def test_truncated_rdata():
+    rr = b"\x00" + RR_HEADER.pack(1, 1, 300, 4) + b"\x7f\x00"
+    with pytest.raises(ParseError):
+        parse_dns_response(header(ancount=1) + rr)
+
+def test_truncated_question():
+    with pytest.raises(ParseError):
+        parse_dns_response(header(qdcount=1) + b"\x03com\x00\x00")
+
+def test_answer_with_compressed_owner():
+    question = b"\x03www\x07example\x03com\x00" + struct.pack("!HH", 1, 1)
+    rr = b"\xc0\x0c" + RR_HEADER.pack(1, 1, 300, 4) + b"\x7f\x00\x00\x01"
+    response = parse_dns_response(header(ancount=1, qdcount=1) + question + rr)
+    assert response.question == [("www.example.com", 1, 1)]
+    assert [(rr.name, rr.ttl, rr.rdata) for rr in response.answer] == [("www.example.com", 300, "127.0.0.1")]
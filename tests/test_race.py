@@ -0,0 +1,60 @@
+import gevent
+import time
+from constants import MIN_RACE_STAGGER, RACE_STAGGER
+from dns_parser import race
+from nameservers import NameserverSelector
+
+
+def task(result, delay=0.0, started=None):
+    def run():
+        if started is not None:
+            started.append(result)
+        gevent.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return run
+
+def accept(result):
+    return result is not None
+
+
+def test_first_accepted_result_wins():
+    assert race([task("slow", 0.2), task("fast", 0.01)], accept, [0.01, 0.01]) == "fast"
+
+def test_next_task_waits_for_the_stagger():
+    started = []
+    assert race([task("first", 0.05, started), task("second", 0, started)], accept, [1.0, 1.0]) == "first"
+    assert started == ["first"]
+
+def test_failure_starts_the_next_task_at_once():
+    start = time.monotonic()
+    tasks = [task(None), task(ValueError("refused")), task("third")]
+    assert race(tasks, accept, [1.0] * 3) == "third"
+    assert time.monotonic() - start < 0.5
+
+def test_every_task_failing():
+    assert race([task(None, 0.01), task(ValueError("refused"))], accept, [0.01, 0.01]) is None
+
+def test_losers_are_cancelled_unless_asked_not_to():
+    finished = []
+
+    def slow():
+        gevent.sleep(0.05)
+        finished.append(True)
+    race([slow, task("fast")], accept, [0.001, 0.001])
+    gevent.sleep(0.1)
+    assert finished == []
+    race([slow, task("fast")], accept, [0.001, 0.001], cancel=False)
+    gevent.sleep(0.1)
+    assert finished == [True]
+
+def test_stagger_follows_the_measured_rtt():
+    selector = NameserverSelector()
+    assert selector.stagger("192.0.2.1") == RACE_STAGGER
+    selector.record_rtt("192.0.2.1", 0.03)
+    assert selector.stagger("192.0.2.1") == 0.06
+    selector.record_rtt("192.0.2.2", 0.001)
+    assert selector.stagger("192.0.2.2") == MIN_RACE_STAGGER
+    selector.record_failure("192.0.2.1")
+    assert selector.stagger("192.0.2.1") == RACE_STAGGER
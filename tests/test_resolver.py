@@ -0,0 +1,116 @@
+import dns_resolver
+import gevent
+import json
+import metrics
+import pytest
+import time
+from benchmarks.hierarchy import Hierarchy, address_of
+from cache import Cache, DelegationCache
+from utils import QType, RCode, Site
+
+
+# End-to-end lookups against benchmarks.hierarchy on loopback. Its zones answer
+# A queries only, any other type gets NODATA.
+PORT = 5399
+
+
+@pytest.fixture(scope="module")
+def hierarchy():
+    hierarchy = Hierarchy(tlds=2, zones=4, servers=2, port=PORT, latency=0, glueless=0.5)
+    hierarchy.start()
+    yield hierarchy
+    hierarchy.stop()
+
+@pytest.fixture
+def resolver(hierarchy, monkeypatch):
+    monkeypatch.setattr(dns_resolver, "ROOT_SERVERS", hierarchy.roots)
+    monkeypatch.setattr(dns_resolver, "DNS_PORT", hierarchy.port)
+
+    def configure(cache=None, ipv6_support=False, serve_stale=False):
+        dns_resolver.app.config.update(
+            cache=Cache() if cache is None else cache, delegations=DelegationCache(), ipv6_support=ipv6_support,
+            serve_stale=serve_stale,
+        )
+        return dns_resolver.app.config["cache"]
+    return configure
+
+def upstream_queries():
+    return sum(metrics.upstream_queries.values.values())
+
+
+def test_negative_answers_without_a_cache(resolver):
+    resolver(Cache(max_size=0, max_negative_size=0))
+    assert dns_resolver.answer_query("missing1.tld1", QType.A)[1] == RCode.NXDOMAIN
+    assert dns_resolver.answer_query("host1.zone1.tld1", QType.AAAA)[1] == RCode.NOERROR
+    records, rcode, _ = dns_resolver.answer_query("host1.zone1.tld1", QType.A)
+    assert rcode == RCode.NOERROR and records
+
+def test_negative_answers_are_counted_once(resolver):
+    cache = resolver()
+    dns_resolver.answer_query("missing1.tld1", QType.A)
+    assert dns_resolver.answer_query("missing1.tld1", QType.A)[1] == RCode.NXDOMAIN
+    assert cache.negative_hits == 1
+
+def test_http_lookup_resolves_the_family_missing_from_the_cache(resolver):
+    cache = resolver()
+    cache.add("host1.zone1.tld1", time.time(), [Site("host1.zone1.tld1", "2001:db8::1", 300)])
+    res_nodes, _, status, _, _ = dns_resolver.lookup_records("host1.zone1.tld1")
+    assert status == "miss"
+    assert {":" in site.ip for site in res_nodes} == {False, True}
+
+def test_http_lookup_after_a_frontend_lookup_of_one_type(resolver):
+    resolver(ipv6_support=True)
+    dns_resolver.answer_query("host1.zone1.tld1", QType.A)
+    res_nodes, _, status, _, negatives = dns_resolver.lookup_records("host1.zone1.tld1")
+    assert status == "miss" and list(negatives) == [QType.AAAA]
+    upstream = upstream_queries()
+    # the NODATA answer for AAAA is cached next to the A records
+    assert dns_resolver.lookup_records("host1.zone1.tld1")[2] == "hit"
+    assert upstream_queries() == upstream
+
+def test_frontend_lookup_resolves_only_its_own_type(resolver):
+    resolver(ipv6_support=True)
+    records, rcode, _ = dns_resolver.answer_query("host2.zone2.tld0", QType.A)
+    assert rcode == RCode.NOERROR and [":" in site.ip for site in records] == [False]
+    upstream = upstream_queries()
+    assert dns_resolver.answer_query("host2.zone2.tld0", QType.A)[1] == RCode.NOERROR
+    assert upstream_queries() == upstream
+
+def test_stale_answer_is_refreshed_in_the_background(resolver):
+    cache = resolver(Cache(max_stale=3600), serve_stale=True)
+    cache.add("host3.zone3.tld1", time.time() - 400, [Site("host3.zone3.tld1", "192.0.2.1", 300)])
+    res_nodes, _, status, _, _ = dns_resolver.lookup_records("host3.zone3.tld1")
+    assert status == "stale" and [site.ip for site in res_nodes] == ["192.0.2.1"]
+    with gevent.Timeout(5):
+        while cache.get("host3.zone3.tld1") is None:
+            gevent.sleep(0.01)
+    res_nodes, _, status, _, _ = dns_resolver.lookup_records("host3.zone3.tld1")
+    assert status == "hit" and [site.ip for site in res_nodes] == [address_of("host3.zone3.tld1")]
+
+def batch(body, **kwargs):
+    response = dns_resolver.app.test_client().post("/get-records/batch", data=body, **kwargs)
+    return response.status_code, [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_batch_answers_every_item(resolver):
+    cache = resolver()
+    cache.add("x.com", time.time(), [Site("x.com", "192.0.2.1", 300)])
+    status, results = batch(json.dumps({"domains": ["x.com", {"domain": "x.com."}]}), content_type="application/json")
+    assert status == 200
+    assert [(result["domain"], result["status"]) for result in results] == [("x.com", "hit")] * 2
+
+def test_batch_rejects_items_that_are_not_domains(resolver):
+    resolver()
+    upstream = upstream_queries()
+    for body, content_type in (
+        (json.dumps([None, 5, {"a": 1}, ["x.com"]]), "application/json"),
+        ('{"a": 1}\n{"domain": 5}\n{broken\n', "application/x-ndjson"),
+    ):
+        status, results = batch(body, content_type=content_type)
+        assert status == 200
+        assert results and all(result["status"] == "error" for result in results)
+    assert upstream_queries() == upstream
+
+def test_batch_rejects_bodies_that_are_not_lists(resolver):
+    resolver()
+    for body in ('{"domain": "x.com"}', '"x.com"', "{broken"):
+        assert batch(body, content_type="application/json")[0] == 400
@@ -0,0 +1,87 @@
+import os
+import snapshot
+import time
+from cache import Cache, DelegationCache
+from snapshot import COUNT, FILE_HEADER, load_snapshot, write_snapshot
+from utils import QType, Site
+
+
+def make_cache():
+    cache = Cache()
+    now = time.time()
+    cache.add("x.com", now, [Site("x.com", "192.0.2.1", 300), Site("x.com", "2001:db8::1", 300)])
+    cache.add("y.com", now, [Site("y.com", "192.0.2.2", 300)])
+    cache.add("old.com", now - 600, [Site("old.com", "192.0.2.3", 300)])
+    cache.get("x.com")
+    delegations = DelegationCache()
+    delegations.add("example.com", ["ns1.example.com"], 3600, [("ns1.example.com", "192.0.2.53", 3600)])
+    return cache, delegations
+
+def restore(path):
+    cache, delegations = Cache(), DelegationCache()
+    reader = load_snapshot(path, cache, delegations)
+    return reader, cache, delegations
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "cache.snapshot")
+    assert write_snapshot(path, *make_cache()) == 2  # the expired entry is left out
+    reader, cache, delegations = restore(path)
+    assert reader is not None
+    assert sorted(site.ip for site in cache.get("x.com")) == ["192.0.2.1", "2001:db8::1"]
+    assert cache.cache["x.com"].hits == 2  # restored hits plus this lookup
+    assert cache.get("old.com") is None
+    zone, nodes = delegations.closest("www.example.com", QType.A)
+    assert zone == "example.com" and [(node.url, node.ip) for node in nodes] == [("ns1.example.com", "192.0.2.53")]
+
+def test_entries_not_loaded_yet_are_carried_over(tmp_path):
+    path = str(tmp_path / "cache.snapshot")
+    write_snapshot(path, *make_cache())
+    _, cache, delegations = restore(path)
+    cache.get("y.com")
+    assert write_snapshot(path, cache, delegations) == 2
+    _, cache, _ = restore(path)
+    assert cache.get("x.com") is not None and cache.get("y.com") is not None
+    assert not os.path.exists(path + ".tmp")
+
+def test_missing_or_truncated_file(tmp_path):
+    path = str(tmp_path / "cache.snapshot")
+    assert restore(path)[0] is None
+    write_snapshot(path, *make_cache())
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 1)
+    assert restore(path)[0] is None
+
+def test_corrupt_delegations(tmp_path):
+    path = str(tmp_path / "cache.snapshot")
+    write_snapshot(path, *make_cache())
+    with open(path, "r+b") as f:
+        delegations_offset = FILE_HEADER.unpack(f.read(FILE_HEADER.size))[-1]
+        f.seek(delegations_offset)
+        f.write(COUNT.pack(0xFFFFFFFF))
+    reader, cache, delegations = restore(path)
+    assert reader is None and delegations.zones == {}
+    assert cache.get("x.com") is None
+
+def test_corrupt_entry(tmp_path):
+    path = str(tmp_path / "cache.snapshot")
+    write_snapshot(path, *make_cache())
+    with open(path, "r+b") as f:
+        data = f.read()
+        f.seek(data.index(b"x.com"))
+        f.write(b"\xff\xfe\xff\xfe\xff")  # not UTF-8
+    reader, cache, _ = restore(path)
+    assert reader is not None
+    assert cache.get("x.com") is None
+    assert cache.get("y.com") is not None
+    # entries are stored least recently used first, the ones before the corrupt one are kept
+    assert [domain for domain, _, _ in reader.items()] == ["y.com"]
+
+def test_data_is_synced_before_the_rename(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.snapshot")
+    events = []
+    monkeypatch.setattr(snapshot.os, "fsync", lambda fd: events.append("fsync"))
+    real_replace = os.replace
+    monkeypatch.setattr(snapshot.os, "replace", lambda *args: (events.append("replace"), real_replace(*args)))
+    write_snapshot(path, *make_cache())
+    assert events == ["fsync", "replace"]
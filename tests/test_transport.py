@@ -0,0 +1,58 @@
+from gevent import monkey
+
+monkey.patch_all()
+
+import gevent
+import pytest
+import time
+from benchmarks.hierarchy import Hierarchy, address_of
+from dns_parser import parse_dns_response
+from transport import Transport
+from utils import QType, make_dns_query
+
+
+# Every UDP reply of this hierarchy is truncated, so every answer comes over TCP.
+PORT = 5397
+LATENCY = 0.02
+
+
+@pytest.fixture(scope="module")
+def server():
+    hierarchy = Hierarchy(tlds=1, zones=1, servers=1, port=PORT, latency=LATENCY, glueless=0, truncation=1.0)
+    hierarchy.start()
+    yield hierarchy.zones["zone0.tld0"]
+    hierarchy.stop()
+
+def query(transport, server, name):
+    message = make_dns_query(name, QType.A)
+    response = transport.query(message, server, PORT, timeout=2)
+    assert response[:2] == message[:2]
+    return parse_dns_response(response)
+
+
+def test_truncated_reply_is_retried_over_tcp(server):
+    transport = Transport()
+    response = query(transport, server, "host0.zone0.tld0")
+    assert not response.tc
+    assert [rr.rdata for rr in response.answer] == [address_of("host0.zone0.tld0")]
+    assert len(transport.udp_sockets) == 1  # the UDP socket went back to the pool
+    assert len(transport.connections) == 1
+
+def test_pipelined_queries_share_one_connection(server):
+    transport = Transport()
+    names = [f"host{i}.zone0.tld0" for i in range(20)]
+    start = time.monotonic()
+    jobs = [gevent.spawn(query, transport, server, name) for name in names]
+    gevent.joinall(jobs, raise_error=True)
+    # answered concurrently: far less than one server latency per query
+    assert time.monotonic() - start < len(names) * LATENCY / 2
+    assert [[rr.rdata for rr in job.value.answer] for job in jobs] == [[address_of(name)] for name in names]
+    assert len(transport.connections) == 1
+
+def test_closed_connection_is_replaced(server):
+    transport = Transport()
+    query(transport, server, "host0.zone0.tld0")
+    connection = next(iter(transport.connections.values()))
+    connection.close()
+    assert query(transport, server, "host1.zone0.tld0").answer
+    assert next(iter(transport.connections.values())) is not connection
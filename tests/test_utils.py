@@ -0,0 +1,72 @@
+import pytest
+import socket
+from benchmarks.parser import encode_response
+from dns_parser import parse_dns_response
+from utils import QType, make_dns_query, question_matches, response_matches, send_udp_message
+
+
+# Replies are accepted only when the ID, the question and the source all match the query.
+SERVER = ("127.0.0.1", 53)
+
+
+def reply_to(message, qname="x.com", ip="192.0.2.1", flags=0x8400):
+    return message[:2] + encode_response(qname, QType.A, answer=[(qname, QType.A, 300, ip)], flags=flags)[2:]
+
+def with_id(data, msg_id):
+    return msg_id.to_bytes(2, "big") + data[2:]
+
+
+def test_queries_get_random_ids():
+    ids = {make_dns_query("x.com", QType.A)[:2] for _ in range(16)}
+    assert len(ids) > 1
+
+def test_question_matches():
+    message = make_dns_query("x.com", QType.A)
+    msg_id = int.from_bytes(message[:2], "big")
+    assert question_matches(message, reply_to(message))
+    assert question_matches(message, reply_to(message, qname="X.Com"))  # names compare case-insensitively
+    assert not question_matches(message, with_id(reply_to(message), msg_id ^ 1))
+    assert not question_matches(message, reply_to(message, qname="y.com"))
+    assert not question_matches(message, reply_to(message, flags=0))  # a query, not a response
+    assert not question_matches(message, reply_to(message)[:5])
+    assert not question_matches(make_dns_query("x.com", QType.AAAA), reply_to(message))
+
+def test_response_matches_the_source():
+    message = make_dns_query("x.com", QType.A)
+    assert response_matches(message, reply_to(message), SERVER, SERVER)
+    assert not response_matches(message, reply_to(message), ("127.0.0.2", 53), SERVER)
+    assert not response_matches(message, reply_to(message), ("127.0.0.1", 5353), SERVER)
+
+@pytest.fixture
+def sockets():
+    opened = []
+
+    def udp_socket():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        opened.append(sock)
+        return sock
+    yield udp_socket
+    for sock in opened:
+        sock.close()
+
+def test_spoofed_replies_are_dropped(sockets):
+    client, server, stranger = sockets(), sockets(), sockets()
+    message = make_dns_query("x.com", QType.A)
+    msg_id = int.from_bytes(message[:2], "big")
+    # queued before the query is even sent, like an off-path attacker racing the server
+    destination = client.getsockname()
+    server.sendto(with_id(reply_to(message, ip="6.6.6.1"), msg_id ^ 1), destination)
+    server.sendto(reply_to(message, qname="y.com", ip="6.6.6.2"), destination)
+    stranger.sendto(reply_to(message, ip="6.6.6.3"), destination)
+    server.sendto(reply_to(message), destination)
+    data = send_udp_message(message, "127.0.0.1", server.getsockname()[1], timeout=1, sock=client)
+    assert [rr.rdata for rr in parse_dns_response(data).answer] == ["192.0.2.1"]
+    assert server.recv(512) == message
+
+def test_no_matching_reply_times_out(sockets):
+    client, server = sockets(), sockets()
+    message = make_dns_query("x.com", QType.A)
+    server.sendto(with_id(reply_to(message), int.from_bytes(message[:2], "big") ^ 1), client.getsockname())
+    with pytest.raises(socket.timeout):
+        send_udp_message(message, "127.0.0.1", server.getsockname()[1], timeout=0.1, sock=client)
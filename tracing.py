@@ -0,0 +1,32 @@
+import logging
+import random
+
+
+class Trace(list):
+    # nameservers queried while resolving a domain; only sampled traces are logged step by step
+    __slots__ = ("sampled",)
+
+    def __init__(self, sampled=False):
+        super().__init__()
+        self.sampled = sampled
+
+
+class Tracer:
+    def __init__(self, sample_rate=0.0):
+        self.sample_rate = sample_rate
+
+    def start(self):
+        return Trace(self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def child(self, trace):
+        # lookups started on behalf of a traced resolution are traced as well
+        return Trace(getattr(trace, "sampled", False))
+
+    def step(self, domain, trace):
+        # hot path: nothing is formatted unless the resolution was sampled
+        if getattr(trace, "sampled", False):
+            trace_repr = ' -> '.join(map(repr, trace))
+            logging.info(f"Resolving step for domain {domain}, current trace is: {trace_repr}")
+
+
+tracer = Tracer()
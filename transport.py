@@ -0,0 +1,138 @@
+import gevent
+import gevent.event
+import gevent.lock
+import logging
+import secrets
+import socket
+import struct
+from constants import TCP_IDLE_TIMEOUT, UDP_SOCKET_POOL_SIZE
+from utils import is_truncated, question_matches, send_udp_message, udp_family
+
+
+TCP_LENGTH = struct.Struct("!H")
+
+
+def receive_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class UDPSocketPool:
+    def __init__(self, size=UDP_SOCKET_POOL_SIZE):
+        self.size = size
+        self.free = {}
+
+    def checkout(self, family):
+        free = self.free.get(family)
+        if free:
+            return free.pop()
+        return socket.socket(family, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+
+    def checkin(self, sock):
+        free = self.free.setdefault(sock.family, [])
+        if len(free) < self.size:
+            free.append(sock)
+        else:
+            sock.close()
+
+    def __len__(self):
+        return sum(len(free) for free in self.free.values())
+
+
+class TCPConnection:
+    # one connection carries many queries at once (RFC 7766, section 6.2.1),
+    # replies are matched back to their queries by message ID
+    def __init__(self, address, port, timeout):
+        self.sock = socket.create_connection((address, port), timeout)
+        self.sock.settimeout(TCP_IDLE_TIMEOUT)
+        self.pending = {}
+        self.write_lock = gevent.lock.Semaphore()
+        self.closed = False
+        self.reader = gevent.spawn(self.read_forever)
+
+    def query(self, message, timeout):
+        msg_id = message[:2]
+        while msg_id in self.pending:  # IDs only have to be unique per connection
+            msg_id = secrets.randbits(16).to_bytes(2, "big")
+        message = msg_id + message[2:]
+        result = gevent.event.AsyncResult()
+        self.pending[msg_id] = (message, result)
+        try:
+            with self.write_lock:
+                self.sock.sendall(TCP_LENGTH.pack(len(message)) + message)
+            data = result.get(timeout=timeout)
+        except gevent.Timeout:
+            raise socket.timeout(f"TCP query timed out after {timeout} seconds")
+        finally:
+            self.pending.pop(msg_id, None)
+        return data
+
+    def read_forever(self):
+        try:
+            while True:
+                try:
+                    prefix = receive_exactly(self.sock, TCP_LENGTH.size)
+                except socket.timeout:
+                    if self.pending:
+                        continue
+                    break
+                if prefix is None:
+                    break
+                data = receive_exactly(self.sock, TCP_LENGTH.unpack(prefix)[0])
+                if data is None:
+                    break
+                entry = self.pending.get(data[:2])
+                if entry is not None and question_matches(entry[0], data):
+                    entry[1].set(data)
+                else:
+                    logging.info("Dropping unmatched response received over TCP")
+        except OSError as e:
+            logging.info(f"TCP connection to nameserver closed: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        for _, result in list(self.pending.values()):
+            if not result.ready():
+                result.set_exception(ConnectionError("TCP connection to nameserver closed"))
+
+
+class Transport:
+    def __init__(self):
+        self.udp_sockets = UDPSocketPool()
+        self.connections = {}
+
+    def query_udp(self, message, address, port, timeout):
+        sock = self.udp_sockets.checkout(udp_family(address))
+        try:
+            response = send_udp_message(message, address, port, timeout, sock)
+        except BaseException:
+            sock.close()  # a late reply would only be dropped by the next query on it
+            raise
+        self.udp_sockets.checkin(sock)
+        return response
+
+    def query_tcp(self, message, address, port, timeout):
+        key = (address, port)
+        connection = self.connections.get(key)
+        if connection is None or connection.closed:
+            connection = self.connections[key] = TCPConnection(address, port, timeout)
+        response = connection.query(message, timeout)
+        return message[:2] + response[2:]
+
+    def query(self, message, address, port, timeout=None):
+        response = self.query_udp(message, address, port, timeout)
+        if is_truncated(response):
+            logging.info(f"Truncated response from {address}, retrying over TCP...")
+            response = self.query_tcp(message, address, port, timeout)
+        return response
+
+
+transport = Transport()
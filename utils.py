@@ -1,9 +1,21 @@
-import binascii
+import functools
 import ipaddress
+import logging
+import secrets
 import socket
+import struct
+import time
 from enum import Enum
 
 
+QUERY_HEADER = struct.Struct("!HHHHHH")
+QUESTION_TAIL = struct.Struct("!HH")
+QUESTION_CACHE_SIZE = 4096
+OPT_RECORD = struct.Struct("!BHHIH")
+TYPE_OPT = 41
+UDP_RECEIVE_SIZE = 0xFFFF
+
+
 class Section(Enum):
     HEADER = 0
     QUESTION = 1
@@ -12,11 +24,24 @@ class Section(Enum):
     ADDITIONAL = 4
 
 class QType(Enum):
-    A = 0
-    NS = 1
+    A = 1
+    NS = 2
+    CNAME = 5
+    SOA = 6
+    TXT = 16
     AAAA = 28
+    DNAME = 39
+
+class RCode:
+    NOERROR = 0
+    FORMERR = 1
+    SERVFAIL = 2
+    NXDOMAIN = 3
+    NOTIMP = 4
 
 class Site:
+    __slots__ = ("ip", "url", "ttl")
+
     def __init__(self, url="", ip="", ttl=0):
         self.ip = ip
         self.url = url
@@ -28,55 +53,141 @@ class Site:
     def __str__(self):
         return f"{self.url} {self.ip}"
 
-def send_udp_message(message, address, port):
-    message = message.replace(" ", "").replace("\n", "")
-    ip = ipaddress.ip_address(address)
-    if ip.version == 6:
-        server_address = (address, port)
-    elif ip.version == 4:
-        server_address = (address, port)
-
-    if socket.has_dualstack_ipv6() and ip.version == 6:
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    else:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+class NegativeAnswer:
+    __slots__ = ("rcode", "ttl")
+
+    def __init__(self, rcode, ttl=0):
+        self.rcode = rcode
+        self.ttl = ttl
+
+    def __repr__(self):
+        return f"{'NXDOMAIN' if self.rcode == RCode.NXDOMAIN else 'NODATA'} {self.ttl}"
+
+class Alias:
+    # CNAME links from the queried name on, as (name, target, ttl), and the
+    # records of the last target when the same answer carried them
+    __slots__ = ("links", "records")
+
+    def __init__(self, links, records=()):
+        self.links = links
+        self.records = records
+
+    @property
+    def target(self):
+        return self.links[-1][1]
+
+    def __repr__(self):
+        return " -> ".join([self.links[0][0]] + [target for _, target, _ in self.links])
+
+class RR:
+    __slots__ = ("name", "type", "cls", "ttl", "rdata")
+
+    def __init__(self, name, type, cls, ttl, rdata):
+        self.name = name
+        self.type = type
+        self.cls = cls
+        self.ttl = ttl
+        self.rdata = rdata
+
+    def __repr__(self):
+        return f"{self.name} {self.ttl} {self.type} {self.rdata}"
+
+class Message:
+    __slots__ = ("id", "flags", "question", "answer", "authority", "additional")
+
+    def __init__(self, id, flags, question, answer, authority, additional):
+        self.id = id
+        self.flags = flags
+        self.question = question
+        self.answer = answer
+        self.authority = authority
+        self.additional = additional
+
+    @property
+    def qr(self):
+        return self.flags >> 15
+
+    @property
+    def aa(self):
+        return (self.flags >> 10) & 1
+
+    @property
+    def tc(self):
+        return (self.flags >> 9) & 1
+
+    @property
+    def rcode(self):
+        return self.flags & 0xF
+
+def question_end(message):
+    # queries are built uncompressed, so QNAME ends at the first zero octet
+    return message.index(b"\x00", QUERY_HEADER.size) + 1 + QUESTION_TAIL.size
+
+def question_matches(message, data):
+    if len(data) < QUERY_HEADER.size or data[:2] != message[:2] or not data[2] & 0x80:
+        return False
+    end = question_end(message)
+    return data[QUERY_HEADER.size : end].lower() == message[QUERY_HEADER.size : end].lower()
+
+def response_matches(message, data, source, server_address):
+    if source[0] != server_address[0] or source[1] != server_address[1]:
+        return False
+    return question_matches(message, data)
+
+def is_truncated(data):
+    return len(data) >= QUERY_HEADER.size and bool(data[2] & 0x02)
+
+def udp_family(address):
+    if socket.has_dualstack_ipv6() and ipaddress.ip_address(address).version == 6:
+        return socket.AF_INET6
+    return socket.AF_INET
+
+def send_udp_message(message, address, port, timeout=None, sock=None):
+    # a socket passed by the caller is left open, replies to earlier queries sent
+    # from it are told apart by the ID and question checks
+    server_address = (str(ipaddress.ip_address(address)), port)
+    own_socket = sock is None
+    if own_socket:
+        sock = socket.socket(udp_family(address), socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    deadline = None if timeout is None else time.monotonic() + timeout
     try:
-        sock.sendto(binascii.unhexlify(message), server_address)
-        data, _ = sock.recvfrom(4096)
+        sock.sendto(message, server_address)
+        while True:
+            sock.settimeout(None if deadline is None else max(deadline - time.monotonic(), 0.001))
+            data, source = sock.recvfrom(UDP_RECEIVE_SIZE)
+            if response_matches(message, data, source, server_address):
+                break
+            logging.info(f"Dropping unmatched response from {source[0]} while waiting for {address}")
     finally:
-        sock.close()
-    return binascii.hexlify(data).decode("utf-8")
-
-def make_dns_query(url, qtype):
-    # HEADER
-    message = "AA AA 00 00 00 01 00 00 00 00 00 00 "
-
-    # QNAME
-    url_sections = url.split(".")
-    for section in url_sections:
-        message += f"{hex(len(section))[2:]:0>2} "
-        for symb in section:
-            message += str(format(ord(symb), "x"))
-            message += " "
-    message += "00 "
-
-    # QTYPE
-    if qtype is QType.A:
-        message += "00 01 "
-    elif qtype is QType.NS:
-        message += "00 02 "
-    elif qtype is QType.AAAA:
-        message += "00 1c "
-    else:
-        message += "00 01 "
-    # QCLASS
-    message += "00 01 "  # IN
-    return message
-
-def check_IPv6_support(dns_port):
+        if own_socket:
+            sock.close()
+    return data
+
+def encode_name(url):
+    qname = b""
+    for section in url.encode("utf-8").split(b"."):
+        if section:
+            qname += bytes((len(section),)) + section
+    return qname + b"\x00"
+
+@functools.lru_cache(maxsize=QUESTION_CACHE_SIZE)
+def encode_question(url, qtype):
+    return encode_name(url) + QUESTION_TAIL.pack(qtype.value, 1)  # QCLASS IN
+
+def make_opt_record(payload_size):
+    # EDNS0 pseudo-record (RFC 6891): root owner name, CLASS carries the UDP payload size
+    return OPT_RECORD.pack(0, TYPE_OPT, payload_size, 0, 0)
+
+def make_dns_query(url, qtype, payload_size=None):
+    if payload_size is None:
+        return QUERY_HEADER.pack(secrets.randbits(16), 0, 1, 0, 0, 0) + encode_question(url, qtype)
+    header = QUERY_HEADER.pack(secrets.randbits(16), 0, 1, 0, 0, 1)
+    return header + encode_question(url, qtype) + make_opt_record(payload_size)
+
+def check_IPv6_support(dns_port, timeout=None):
     try:
         message = make_dns_query("google.com", QType.AAAA)
-        _ = send_udp_message(message, "2001:4860:4860::8888", dns_port)
+        _ = send_udp_message(message, "2001:4860:4860::8888", dns_port, timeout)
     except Exception as e:
         return False
     return True
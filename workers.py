@@ -0,0 +1,44 @@
+import logging
+import os
+import signal
+import socket
+
+
+LISTEN_BACKLOG = 1024
+
+
+def reuse_port_socket(address, port, kind=socket.SOCK_STREAM):
+    # every worker binds its own socket to the same port and the kernel spreads
+    # connections and datagrams between them
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    sock = socket.socket(family, kind)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((address, port))
+    if kind == socket.SOCK_STREAM:
+        sock.listen(LISTEN_BACKLOG)
+    return sock
+
+def fork_workers(count):
+    # returns the worker number in a worker and None in the parent once every worker exited
+    children = {}
+    for number in range(count):
+        pid = os.fork()
+        if pid == 0:
+            return number
+        children[pid] = number
+
+    def forward(signum, frame):
+        for pid in children:
+            os.kill(pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the terminal delivers Ctrl+C to the workers itself
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        number = children.pop(pid, None)
+        logging.info(f"Worker {number} exited with status {status}")
+    return None